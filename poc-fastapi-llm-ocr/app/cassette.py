@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# Modo dos provedores de LLM:
+#   live             chama os provedores (padrão)
+#   record           chama os provedores e grava cada par requisição/resposta no cassete
+#   replay           responde só pelo cassete; requisição não gravada vira HTTP 503
+#   replay_or_record responde pelo cassete e, se não houver gravação, chama o provedor e grava
+LLM_PROVIDER_MODE = os.getenv("LLM_PROVIDER_MODE", "live").lower()
+LLM_CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", "llm_cassette.db")
+# Latência das respostas reproduzidas: original, zero ou um fator sobre a original (ex.: 0.5)
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "original").lower()
+
+MODES = ("live", "record", "replay", "replay_or_record")
+if LLM_PROVIDER_MODE not in MODES:
+    raise ValueError(f"LLM_PROVIDER_MODE inválido: {LLM_PROVIDER_MODE} (use {', '.join(MODES)}).")
+
+CASSETTE_HITS = metrics.counter("llm_cassette_hits_total", "Respostas de LLM reproduzidas do cassete.")
+CASSETTE_MISSES = metrics.counter("llm_cassette_misses_total", "Requisições de LLM sem gravação no cassete.")
+CASSETTE_RECORDED = metrics.counter("llm_cassette_recorded_total", "Respostas de LLM gravadas no cassete.")
+
+
+class CassetteMiss(HTTPException):
+    """
+    No modo replay, a requisição ao provedor não foi gravada.
+    """
+
+    def __init__(self, provider: str):
+        super().__init__(
+            status_code=503,
+            detail=f"Resposta do provedor {provider} não gravada no cassete (LLM_PROVIDER_MODE=replay).",
+        )
+
+
+def make_key(provider: str, kind: str, request: dict, image: Optional[bytes] = None) -> str:
+    """
+    Chave da gravação: provedor, tipo de chamada, hash da requisição (prompt, modelo, parâmetros)
+    e hash da imagem enviada, quando houver.
+    """
+    raw = json.dumps([provider, kind, request], sort_keys=True, ensure_ascii=False, default=str)
+    request_hash = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+    image_hash = hashlib.sha256(image).hexdigest()[:32] if image else "-"
+    return f"{provider}:{kind}:{request_hash}:{image_hash}"
+
+
+class CassetteStore:
+    """
+    Gravações em um arquivo SQLite próprio; a resposta fica em JSON comprimido (zlib).
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cassette ("
+            "key TEXT PRIMARY KEY, provider TEXT NOT NULL, latency REAL NOT NULL, "
+            "payload BLOB NOT NULL, recorded_at REAL NOT NULL)"
+        )
+
+    def get(self, key: str):
+        """
+        Retorna (latência original em s, resposta) ou None.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT latency, payload FROM llm_cassette WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(zlib.decompress(row[1]))
+
+    def put(self, key: str, provider: str, latency: float, payload) -> None:
+        data = zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO llm_cassette (key, provider, latency, payload, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                (key, provider, latency, data, time.time()),
+            )
+
+
+_store: Optional[CassetteStore] = None
+_store_lock = threading.Lock()
+
+
+def store() -> CassetteStore:
+    # aberto no primeiro uso: cada processo (API ou worker da fila) tem a sua conexão
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CassetteStore(LLM_CASSETTE_PATH)
+        return _store
+
+
+def replay_delay(latency: float) -> float:
+    if LLM_REPLAY_LATENCY == "zero":
+        return 0.0
+    if LLM_REPLAY_LATENCY == "original":
+        return latency
+    return latency * float(LLM_REPLAY_LATENCY)
+
+
+def _lookup(key: str, provider: str):
+    """
+    Procura a gravação nos modos de replay; sem gravação, lança CassetteMiss no modo replay.
+    """
+    if LLM_PROVIDER_MODE not in ("replay", "replay_or_record"):
+        return None
+    recorded = store().get(key)
+    if recorded is not None:
+        CASSETTE_HITS.inc()
+        return recorded
+    CASSETTE_MISSES.inc()
+    if LLM_PROVIDER_MODE == "replay":
+        raise CassetteMiss(provider)
+    return None
+
+
+def _record(key: str, provider: str, latency: float, payload) -> None:
+    try:
+        store().put(key, provider, latency, payload)
+        CASSETTE_RECORDED.inc()
+    except sqlite3.Error as e:
+        logger.warning("Falha ao gravar a resposta no cassete: %s", e)
+
+
+async def through(key: str, provider: str, call: Callable[[], Awaitable]):
+    """
+    Executa `call` (chamada ao provedor que retorna uma resposta serializável em JSON) conforme
+    LLM_PROVIDER_MODE: direto, gravando, ou reproduzindo a resposta gravada.
+    """
+    if LLM_PROVIDER_MODE == "live":
+        return await call()
+    recorded = await asyncio.to_thread(_lookup, key, provider)
+    if recorded is not None:
+        latency, payload = recorded
+        await asyncio.sleep(replay_delay(latency))
+        return payload
+
+    started = time.perf_counter()
+    payload = await call()
+    await asyncio.to_thread(_record, key, provider, time.perf_counter() - started, payload)
+    return payload
+
+
+def through_sync(key: str, provider: str, call: Callable):
+    """
+    Como `through`, para chamadas bloqueantes (SDK do Gemini).
+    """
+    if LLM_PROVIDER_MODE == "live":
+        return call()
+    recorded = _lookup(key, provider)
+    if recorded is not None:
+        latency, payload = recorded
+        time.sleep(replay_delay(latency))
+        return payload
+
+    started = time.perf_counter()
+    payload = call()
+    _record(key, provider, time.perf_counter() - started, payload)
+    return payload
+
+
+async def open_stream(key: str, provider: str, open_live: Callable[[], Awaitable[AsyncIterator]]) -> AsyncIterator:
+    """
+    Versão de `through` para respostas em streaming. `open_live` abre o stream do provedor e retorna
+    um iterador assíncrono de trechos (str ou bytes); os trechos são gravados com o instante de cada um
+    e reproduzidos no mesmo ritmo. Só streams lidos até o fim são gravados.
+    """
+    if LLM_PROVIDER_MODE == "live":
+        return await open_live()
+    recorded = await asyncio.to_thread(_lookup, key, provider)
+    if recorded is not None:
+        return _replay_chunks(recorded[1])
+
+    started = time.perf_counter()
+    return _recording(key, provider, started, await open_live())
+
+
+async def _replay_chunks(payload: dict) -> AsyncIterator:
+    previous = 0.0
+    for offset, chunk in payload["chunks"]:
+        await asyncio.sleep(replay_delay(offset - previous))
+        previous = offset
+        yield chunk.encode("latin-1") if payload.get("binary") else chunk
+
+
+async def _recording(key: str, provider: str, started: float, chunks: AsyncIterator) -> AsyncIterator:
+    recorded, binary = [], False
+    try:
+        async for chunk in chunks:
+            if isinstance(chunk, bytes):
+                # latin-1 leva cada byte a um caractere: o trecho volta igual no replay
+                binary = True
+                recorded.append((time.perf_counter() - started, chunk.decode("latin-1")))
+            else:
+                recorded.append((time.perf_counter() - started, chunk))
+            yield chunk
+    finally:
+        await chunks.aclose()
+    latency = time.perf_counter() - started
+    await asyncio.to_thread(_record, key, provider, latency, {"chunks": recorded, "binary": binary})
@@ -0,0 +1,59 @@
+import os
+import threading
+import time
+from typing import Optional
+
+from app.models import Configurations
+
+# Intervalo (s) em que o prompt em cache é usado sem consultar o banco. Depois disso só a
+# versão é lida; o prompt é recarregado quando outro processo o alterou via PUT /configuration.
+CONFIG_CACHE_TTL = float(os.getenv("CONFIG_CACHE_TTL", "5"))
+
+
+class ConfigurationCache:
+    """
+    Cache em processo da configuração de extração (tabela configurations).
+    """
+
+    def __init__(self, ttl: float = CONFIG_CACHE_TTL):
+        self.ttl = ttl
+        self._prompt: Optional[str] = None
+        self._version: Optional[int] = None
+        self._checked_at = 0.0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def get_prompt(self, session) -> Optional[str]:
+        """
+        Retorna o prompt configurado (ou None), consultando o banco no máximo uma vez por `ttl`.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._loaded and now - self._checked_at < self.ttl:
+                return self._prompt
+
+        row = session.query(Configurations.id, Configurations.version).order_by(Configurations.id).first()
+        version = (row.version or 0) if row else None
+
+        with self._lock:
+            if self._loaded and version == self._version:
+                self._checked_at = now
+                return self._prompt
+
+        config = session.get(Configurations, row.id) if row else None
+        self.set(config.prompt if config else None, version)
+        return config.prompt if config else None
+
+    def set(self, prompt: Optional[str], version: Optional[int]) -> None:
+        with self._lock:
+            self._prompt = prompt
+            self._version = version
+            self._checked_at = time.monotonic()
+            self._loaded = True
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded = False
+
+
+cache = ConfigurationCache()
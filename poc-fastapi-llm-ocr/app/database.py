@@ -1,12 +1,100 @@
-from sqlalchemy import create_engine
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+# Carregado aqui porque o banco é o primeiro módulo da aplicação a ler o ambiente
+load_dotenv()
+
+# Padrão: SQLite local. Aceita qualquer URL do SQLAlchemy (ex.: postgresql://...)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///invoices.db")
+
+# Drivers assíncronos usados pelas rotas async quando ASYNC_DATABASE_URL não é informada
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"}
+
+
+def _async_url(url: str) -> str:
+    backend = make_url(url)
+    driver = ASYNC_DRIVERS.get(backend.get_backend_name())
+    if driver is None:
+        raise ValueError(f"Sem driver assíncrono conhecido para {backend.get_backend_name()}; defina ASYNC_DATABASE_URL.")
+    return backend.set(drivername=f"{backend.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+# Pool de conexões (por processo)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+# PRAGMAs aplicados a cada conexão SQLite. WAL permite leitores concorrentes com um escritor
+# e, com vários workers do uvicorn, o busy_timeout faz o escritor esperar em vez de falhar
+# com "database is locked".
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        # valor negativo = tamanho em KiB (e não em páginas)
+        cursor.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+    finally:
+        cursor.close()
+
+
+def _engine_options(url: str) -> dict:
+    backend = make_url(url)
+    if backend.get_backend_name() != "sqlite":
+        return dict(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                    pool_timeout=DB_POOL_TIMEOUT, pool_pre_ping=True)
+    if backend.database in (None, "", ":memory:"):
+        # banco em memória usa uma conexão por thread; não há pool para dimensionar
+        return {}
+    return dict(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+
+
+def create_db_engine(url: str = DATABASE_URL):
+    """
+    Cria o engine do banco. Para SQLite aplica os PRAGMAs de concorrência em cada conexão nova.
+    """
+    engine = create_engine(url, **_engine_options(url))
+    if make_url(url).get_backend_name() == "sqlite":
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+
+def create_async_db_engine(url: str = ASYNC_DATABASE_URL):
+    """
+    Cria o engine assíncrono (aiosqlite por padrão) usado pelas rotas async, com os mesmos PRAGMAs.
+    """
+    engine = create_async_engine(url, **_engine_options(url))
+    if make_url(url).get_backend_name() == "sqlite":
+        event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+
 #Create sqlite engine instance
-engine = create_engine("sqlite:///invoices.db")
+engine = create_db_engine()
 
 #Create declaritive base meta instance
 Base = declarative_base()
 
 #Create session local class for session maker
-SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
\ No newline at end of file
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+
+# Versão assíncrona: as rotas async acessam o banco sem bloquear o event loop
+async_engine = create_async_db_engine()
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import importlib.util
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image, ImageOps
+
+from app import image_preprocess, metrics
+
+logger = logging.getLogger(__name__)
+
+# Notas em PDF ou TIFF com várias páginas: cada página é rasterizada sob demanda em um pool de
+# processos e extraída separadamente. No máximo DOCUMENT_PAGE_WINDOW páginas por documento ficam
+# em memória (rasterizadas ou em extração) ao mesmo tempo.
+DOCUMENT_PAGE_WINDOW = int(os.getenv("DOCUMENT_PAGE_WINDOW", "4"))
+DOCUMENT_MAX_PAGES = int(os.getenv("DOCUMENT_MAX_PAGES", "50"))
+DOCUMENT_RENDER_DPI = int(os.getenv("DOCUMENT_RENDER_DPI", "200"))
+DOCUMENT_WORKERS = int(os.getenv("DOCUMENT_WORKERS", str(min(4, os.cpu_count() or 1))))
+MAX_DOCUMENT_UPLOAD_BYTES = int(os.getenv("MAX_DOCUMENT_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+
+# Páginas rasterizadas são enviadas ao modelo como JPEG
+PAGE_CONTENT_TYPE = "image/jpeg"
+
+PDF_CONTENT_TYPES = {"application/pdf", "application/x-pdf"}
+TIFF_CONTENT_TYPES = {"image/tiff", "image/tif"}
+
+DOCUMENT_PAGES = metrics.counter("document_pages_total", "Páginas de documentos PDF/TIFF rasterizadas.")
+DOCUMENT_PAGE_FAILURES = metrics.counter("document_page_failures_total", "Páginas de documentos PDF/TIFF cuja extração falhou.")
+DOCUMENT_RENDER_SECONDS = metrics.histogram("document_render_seconds", "Tempo para rasterizar uma página de PDF/TIFF.")
+# as mesmas séries de main.read_upload (o registro devolve o contador já criado com o nome)
+UPLOADS = metrics.counter("uploads_total", "Arquivos recebidos por upload.")
+UPLOAD_BYTES = metrics.counter("upload_bytes_total", "Bytes recebidos por upload.")
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def document_kind(content_type: Optional[str], filename: Optional[str] = None) -> Optional[str]:
+    """
+    Retorna "pdf" ou "tiff" para documentos que podem ter várias páginas, ou None para as demais imagens.
+    """
+    content_type = (content_type or "").lower()
+    extension = os.path.splitext(filename or "")[1].lower()
+    if content_type in PDF_CONTENT_TYPES or extension == ".pdf":
+        return "pdf"
+    if content_type in TIFF_CONTENT_TYPES or extension in (".tif", ".tiff"):
+        return "tiff"
+    return None
+
+
+def _check_signature(path: str, kind: str) -> None:
+    with open(path, "rb") as file:
+        header = file.read(4)
+    valid = header.startswith(b"%PDF") if kind == "pdf" else header in (b"II*\x00", b"MM\x00*")
+    if not valid:
+        raise HTTPException(status_code=400, detail=f"O arquivo enviado não é um {kind.upper()} válido.")
+
+
+async def spool_upload(file: UploadFile, kind: str, limit: int = MAX_DOCUMENT_UPLOAD_BYTES) -> tuple[str, str]:
+    """
+    Copia o upload em blocos para um arquivo temporário (sem carregar o documento inteiro em memória)
+    e calcula o hash MD5 no caminho. Retorna (caminho, hash); o chamador remove o arquivo.
+    """
+    md5 = hashlib.md5()
+    size = 0
+    handle = tempfile.NamedTemporaryFile(suffix=f".{kind}", delete=False)
+    UPLOADS.inc()
+    try:
+        with handle:
+            while chunk := await file.read(1024 * 1024):
+                size += len(chunk)
+                UPLOAD_BYTES.inc(len(chunk))
+                if size > limit:
+                    raise HTTPException(status_code=413, detail=f"O arquivo excede o limite de {limit} bytes.")
+                md5.update(chunk)
+                handle.write(chunk)
+        _check_signature(handle.name, kind)
+    except BaseException:
+        discard(handle.name)
+        raise
+    return handle.name, md5.hexdigest()
+
+
+def discard(path: str) -> None:
+    """
+    Remove o arquivo temporário do upload; pode ser chamada mais de uma vez.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _open_pdf(path: str):
+    import pypdfium2
+
+    return pypdfium2.PdfDocument(path)
+
+
+def _page_count(path: str, kind: str) -> int:
+    """
+    Executa no processo do pool: número de páginas do documento.
+    """
+    if kind == "pdf":
+        document = _open_pdf(path)
+        try:
+            return len(document)
+        finally:
+            document.close()
+    with Image.open(path) as image:
+        return getattr(image, "n_frames", 1)
+
+
+def _fit(image: Image.Image, max_edge: int) -> Image.Image:
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return image
+
+
+def _render_page(path: str, kind: str, index: int, dpi: int, max_edge: int) -> bytes:
+    """
+    Executa no processo do pool: rasteriza só a página `index` e a retorna em JPEG,
+    já no tamanho enviado ao modelo (maior lado até `max_edge`).
+    """
+    if kind == "pdf":
+        document = _open_pdf(path)
+        try:
+            page = document[index]
+            width, height = page.get_size()
+            # resolução pedida, sem passar do tamanho que o pré-processamento manteria
+            scale = min(dpi / 72, max_edge / max(width, height))
+            image = page.render(scale=scale).to_pil()
+            page.close()
+        finally:
+            document.close()
+    else:
+        with Image.open(path) as tiff:
+            tiff.seek(index)
+            image = ImageOps.exif_transpose(tiff.copy())
+
+    image = _fit(image, max_edge)
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=image_preprocess.IMAGE_JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def _warm_up() -> None:
+    # carrega o pypdfium2 no processo do pool antes da primeira página
+    if importlib.util.find_spec("pypdfium2") is not None:
+        import pypdfium2  # noqa: F401
+
+
+def start_pool() -> ProcessPoolExecutor:
+    """
+    Cria o pool de processos que rasteriza as páginas. Chamado no startup da aplicação.
+
+    Usa spawn: o processo da API já tem threads (threadpool, aiosqlite) e o event loop rodando,
+    e um fork copiaria locks possivelmente travados para os filhos.
+    """
+    global _executor
+    if _executor is None:
+        workers = max(1, DOCUMENT_WORKERS)
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        # Dispara a criação dos processos já no startup
+        for _ in range(workers):
+            _executor.submit(_warm_up)
+    return _executor
+
+
+def shutdown_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def page_count(path: str, kind: str) -> int:
+    """
+    Conta as páginas do documento; documentos ilegíveis ou acima de DOCUMENT_MAX_PAGES viram HTTP 400.
+    """
+    # pypdfium2 é opcional: sem ele só TIFF é aceito
+    if kind == "pdf" and importlib.util.find_spec("pypdfium2") is None:
+        raise HTTPException(status_code=415, detail="Suporte a PDF indisponível: instale o pacote pypdfium2.")
+
+    loop = asyncio.get_running_loop()
+    try:
+        pages = await loop.run_in_executor(start_pool(), _page_count, path, kind)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Não foi possível abrir o documento enviado: {e}")
+    if pages > DOCUMENT_MAX_PAGES:
+        raise HTTPException(
+            status_code=400, detail=f"O documento excede o limite de {DOCUMENT_MAX_PAGES} páginas."
+        )
+    return pages
+
+
+async def extract_pages(
+    path: str,
+    kind: str,
+    pages: int,
+    extract: Callable[[bytes], Awaitable[dict]],
+    window: int = DOCUMENT_PAGE_WINDOW,
+) -> AsyncIterator[dict]:
+    """
+    Rasteriza e extrai as páginas em paralelo, com no máximo `window` páginas em andamento, e produz
+    o resultado de cada página assim que ele fica pronto (fora de ordem):
+    {"pagina": n, "campos": {...}} ou {"pagina": n, "status_code": ..., "erro": ...}.
+    """
+    loop = asyncio.get_running_loop()
+    executor = start_pool()
+
+    async def process(index: int) -> dict:
+        try:
+            with DOCUMENT_RENDER_SECONDS.time():
+                image = await loop.run_in_executor(
+                    executor, _render_page, path, kind, index, DOCUMENT_RENDER_DPI, image_preprocess.IMAGE_MAX_EDGE
+                )
+            DOCUMENT_PAGES.inc()
+            return {"pagina": index + 1, "status_code": 200, "campos": await extract(image)}
+        except HTTPException as e:
+            DOCUMENT_PAGE_FAILURES.inc()
+            return {"pagina": index + 1, "status_code": e.status_code, "erro": e.detail}
+        except Exception as e:
+            DOCUMENT_PAGE_FAILURES.inc()
+            logger.warning("Falha na página %s do documento: %s", index + 1, e)
+            return {"pagina": index + 1, "status_code": 500, "erro": str(e)}
+
+    next_page = 0
+    running: set[asyncio.Task] = set()
+    try:
+        while next_page < pages or running:
+            while next_page < pages and len(running) < max(1, window):
+                running.add(asyncio.create_task(process(next_page)))
+                next_page += 1
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda task: task.result()["pagina"]):
+                yield task.result()
+    finally:
+        # cliente desconectou: não deixa páginas órfãs em extração
+        for task in running:
+            task.cancel()
+
+
+def _most_common(values: list):
+    # valor mais frequente; no empate, o da primeira página
+    counts = Counter(values)
+    return max(values, key=lambda value: (counts[value], -values.index(value))) if values else None
+
+
+def merge_pages(results: list[dict]) -> dict:
+    """
+    Junta os campos de cabeçalho das páginas: CNPJ e data pelo valor mais frequente entre as páginas
+    (no empate, o da primeira), valor total pela última página que o informa (onde o total costuma estar).
+    """
+    pages = sorted((r for r in results if "campos" in r), key=lambda r: r["pagina"])
+    fields = [r["campos"] for r in pages]
+    valores = [f.get("valor") for f in fields if f.get("valor") is not None]
+    return {
+        "cnpj": _most_common([f.get("cnpj") for f in fields if f.get("cnpj")]),
+        "data": _most_common([f.get("data") for f in fields if f.get("data")]),
+        "valor": valores[-1] if valores else None,
+    }
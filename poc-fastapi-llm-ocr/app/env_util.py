@@ -0,0 +1,8 @@
+import os
+
+
+def env_flag(name: str, default: str) -> bool:
+    """
+    Lê uma variável de ambiente booleana ("1", "true", "yes" ou "on" ativam).
+    """
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "on")
@@ -2,6 +2,8 @@ import hashlib
 import io
 from typing import Union
 
+from PIL import Image, ImageOps
+
 def gerar_hash_imagem(image_data: Union[bytes, io.BytesIO]) -> str:
     """
     Gera o hash MD5 de uma imagem.
@@ -26,4 +28,35 @@ def gerar_hash_imagem(image_data: Union[bytes, io.BytesIO]) -> str:
     md5_hash = hashlib.md5(bytes_to_hash)
     
     # Retorna o hash em formato hexadecimal
-    return md5_hash.hexdigest()
\ No newline at end of file
+    return md5_hash.hexdigest()
+
+
+def gerar_dhash_imagem(image_data: bytes, hash_size: int = 8) -> str:
+    """
+    Gera o hash perceptual (dHash) de uma imagem.
+
+    Diferente do MD5, imagens visualmente iguais (mesma nota recomprimida ou redimensionada)
+    produzem hashes com poucos bits diferentes.
+
+    Args:
+        image_data: Os dados binários da imagem.
+        hash_size: Lado da grade comparada; 8 gera um hash de 64 bits.
+
+    Returns:
+        Uma string hexadecimal com hash_size * hash_size bits.
+    """
+    with Image.open(io.BytesIO(image_data)) as image:
+        # Só precisamos de uma miniatura: o draft evita decodificar o JPEG em resolução cheia
+        image.draft("L", (hash_size * 16, hash_size * 16))
+        image = ImageOps.exif_transpose(image)
+        small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+
+    return f"{bits:0{hash_size * hash_size // 4}x}"
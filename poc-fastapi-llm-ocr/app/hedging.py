@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# Extração "hedged": começa pelo provedor primário e, se ele não responder dentro do percentil
+# HEDGE_PERCENTILE da própria latência, dispara também o secundário; vale o primeiro resultado válido.
+HEDGE_PRIMARY = os.getenv("HEDGE_PRIMARY", "gemini")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))            # latências recentes usadas no percentil
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))   # abaixo disso usa HEDGE_DEFAULT_DELAY
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "8"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "30"))
+
+HEDGE_REQUESTS = metrics.counter("hedge_requests_total", "Extrações feitas no modo hedged.")
+HEDGE_SECONDARY_LAUNCHED = metrics.counter("hedge_secondary_launched_total", "Extrações hedged em que o provedor secundário foi acionado.")
+HEDGE_CANCELLED = metrics.counter("hedge_cancelled_total", "Chamadas perdedoras canceladas no modo hedged.")
+HEDGE_WINS = metrics.counter("hedge_wins_total", "Extrações hedged vencidas por cada provedor.", labelnames=("provider",))
+EXTRACTION_SECONDS = metrics.histogram(
+    "llm_extraction_seconds", "Duração das extrações bem-sucedidas por provedor (OCR, LLM e parse do JSON).", labelnames=("provider",)
+)
+
+
+class LatencyTracker:
+    """
+    Janela das latências mais recentes de sucesso de um provedor, para calcular percentis.
+    """
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, round(q / 100 * len(samples)) - 1))
+        return samples[index]
+
+
+_trackers: dict[str, LatencyTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def tracker(provider: str) -> LatencyTracker:
+    with _trackers_lock:
+        if provider not in _trackers:
+            _trackers[provider] = LatencyTracker()
+        return _trackers[provider]
+
+
+def record_latency(provider: str, seconds: float) -> None:
+    """
+    Registra a latência de uma extração bem-sucedida (chamada também pelas rotas de um só provedor).
+    """
+    tracker(provider).record(seconds)
+    EXTRACTION_SECONDS.observe(seconds, provider=provider)
+
+
+def hedge_delay(provider: str) -> float:
+    """
+    Quanto esperar pelo provedor antes de acionar o outro: o percentil configurado da latência dele.
+    """
+    latencies = tracker(provider)
+    delay = latencies.percentile(HEDGE_PERCENTILE) if len(latencies) >= HEDGE_MIN_SAMPLES else None
+    if delay is None:
+        delay = HEDGE_DEFAULT_DELAY
+    return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, delay))
+
+
+def _is_valid(result) -> bool:
+    # resultado sem nenhum campo preenchido só é aceito se o outro provedor também não trouxer nada
+    return isinstance(result, dict) and any(value is not None for value in result.values())
+
+
+async def run_hedged(providers: dict[str, Callable[[], Awaitable[dict]]], primary: str = HEDGE_PRIMARY):
+    """
+    Executa o provedor `primary` e, se ele não responder a tempo (ou falhar), o outro provedor de `providers`.
+    Retorna (provedor vencedor, resultado) do primeiro resultado válido e cancela as chamadas restantes.
+    Se nenhum trouxer resultado válido, retorna o primeiro resultado obtido ou relança o erro do primário.
+    """
+    HEDGE_REQUESTS.inc()
+    if primary not in providers:
+        primary = next(iter(providers))
+    secondary = next((name for name in providers if name != primary), None)
+
+    def start(name: str) -> asyncio.Task:
+        # a latência de cada provedor é registrada pela própria função de extração (record_latency)
+        task = asyncio.ensure_future(providers[name]())
+        names[task] = name
+        return task
+
+    names: dict[asyncio.Task, str] = {}
+    pending = {start(primary)}
+    delay = hedge_delay(primary)
+    fallback = None
+    errors: dict[str, BaseException] = {}
+
+    try:
+        while pending:
+            timeout = delay if secondary and secondary not in names.values() else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                name = names[task]
+                if task.exception() is not None:
+                    errors[name] = task.exception()
+                    logger.warning("Extração hedged: %s falhou: %s", name, task.exception())
+                    continue
+                result = task.result()
+                if _is_valid(result):
+                    HEDGE_WINS.inc(provider=name)
+                    return name, result
+                if fallback is None:
+                    fallback = (name, result)
+
+            # primário atrasado além do percentil, ou já terminou sem resultado válido: aciona o secundário
+            if secondary and secondary not in names.values():
+                HEDGE_SECONDARY_LAUNCHED.inc()
+                logger.info("Extração hedged: acionando %s após %.2f s.", secondary, delay)
+                pending.add(start(secondary))
+    finally:
+        for task in pending:
+            task.cancel()
+            HEDGE_CANCELLED.inc()
+
+    if fallback is not None:
+        return fallback
+    raise errors.get(primary) or next(iter(errors.values()))
@@ -0,0 +1,66 @@
+import os
+from typing import Optional
+
+import httpx
+
+# Cliente HTTP assíncrono compartilhado durante toda a vida da aplicação.
+# Mantém conexões keep-alive abertas com a API do Mistral, evitando um novo
+# handshake TCP/TLS a cada requisição.
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    """
+    Cria o cliente com pool de conexões e timeouts configuráveis por variável de ambiente.
+
+    Variáveis:
+        MISTRAL_POOL_SIZE: número máximo de conexões simultâneas (padrão 20).
+        MISTRAL_POOL_KEEPALIVE: conexões ociosas mantidas abertas (padrão = MISTRAL_POOL_SIZE).
+        MISTRAL_KEEPALIVE_EXPIRY: segundos que uma conexão ociosa fica no pool (padrão 30).
+        MISTRAL_TIMEOUT: timeout de leitura/escrita por requisição em segundos (padrão 60).
+        MISTRAL_CONNECT_TIMEOUT: timeout de conexão em segundos (padrão 5).
+        MISTRAL_POOL_TIMEOUT: tempo máximo esperando uma conexão livre no pool (padrão 10).
+    """
+    pool_size = int(os.getenv("MISTRAL_POOL_SIZE", "20"))
+    limits = httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=int(os.getenv("MISTRAL_POOL_KEEPALIVE", str(pool_size))),
+        keepalive_expiry=float(os.getenv("MISTRAL_KEEPALIVE_EXPIRY", "30")),
+    )
+    timeout = httpx.Timeout(
+        float(os.getenv("MISTRAL_TIMEOUT", "60")),
+        connect=float(os.getenv("MISTRAL_CONNECT_TIMEOUT", "5")),
+        pool=float(os.getenv("MISTRAL_POOL_TIMEOUT", "10")),
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+async def open_client() -> httpx.AsyncClient:
+    """
+    Abre o cliente compartilhado. Chamado no startup da aplicação.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+async def close_client() -> None:
+    """
+    Fecha o cliente compartilhado e libera as conexões do pool. Chamado no shutdown.
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Retorna o cliente compartilhado, criando-o sob demanda caso o startup não tenha rodado
+    (ex.: uso fora do servidor).
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
@@ -0,0 +1,110 @@
+import io
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps
+
+from app import metrics
+from app.env_util import env_flag
+
+logger = logging.getLogger(__name__)
+
+
+# Pré-processamento aplicado antes das chamadas ao Gemini Vision e ao OCR.
+IMAGE_PREPROCESS = env_flag("IMAGE_PREPROCESS", "true")
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1600"))          # maior lado enviado ao Gemini
+IMAGE_OCR_MAX_EDGE = int(os.getenv("IMAGE_OCR_MAX_EDGE", "3000"))  # maior lado enviado ao Tesseract
+IMAGE_GRAYSCALE = env_flag("IMAGE_GRAYSCALE", "true")
+IMAGE_AUTOCONTRAST = env_flag("IMAGE_AUTOCONTRAST", "true")
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+PREPROCESS_TOTAL = metrics.counter("image_preprocess_total", "Imagens pré-processadas.")
+PREPROCESS_SECONDS = metrics.counter("image_preprocess_seconds_total", "Tempo total de pré-processamento de imagens.")
+BYTES_IN = metrics.counter("image_preprocess_bytes_in_total", "Bytes das imagens antes do pré-processamento.")
+BYTES_OUT = metrics.counter("image_preprocess_bytes_out_total", "Bytes das imagens após o pré-processamento.")
+PREPROCESS_SKIPPED = metrics.counter(
+    "image_preprocess_skipped_total", "Imagens que o Pillow não decodifica (ex.: HEIC), enviadas sem pré-processamento."
+)
+
+# Erros do Pillow para arquivos que ele não abre: formato desconhecido (UnidentifiedImageError é um
+# OSError), arquivo truncado ou imagem grande demais (proteção contra decompression bomb)
+UNREADABLE_IMAGE_ERRORS = (OSError, Image.DecompressionBombError)
+
+
+@dataclass
+class PreprocessResult:
+    data: bytes
+    content_type: str
+    original_bytes: int
+    processed_bytes: int
+    seconds: float
+
+
+def prepare(image_data: bytes, max_edge: int = IMAGE_MAX_EDGE) -> Image.Image:
+    """
+    Decodifica a imagem e aplica o pipeline: rotação pelo EXIF, redução para `max_edge`,
+    tons de cinza e normalização de contraste.
+    """
+    image = Image.open(io.BytesIO(image_data))
+
+    # JPEG em modo draft: o decoder já reduz a escala (1/2, 1/4, 1/8) sem decodificar a imagem cheia
+    if image.format == "JPEG":
+        image.draft("L" if IMAGE_GRAYSCALE else "RGB", (max_edge, max_edge))
+
+    image = ImageOps.exif_transpose(image)
+
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    image = image.convert("L" if IMAGE_GRAYSCALE else "RGB")
+
+    if IMAGE_AUTOCONTRAST:
+        image = ImageOps.autocontrast(image, cutoff=1)
+
+    return image
+
+
+def preprocess_image(image_data: bytes, content_type: str, max_edge: int = IMAGE_MAX_EDGE) -> PreprocessResult:
+    """
+    Aplica o pipeline e recodifica em JPEG. Se o resultado ficar maior que o original, ou se o Pillow
+    não decodificar a imagem (ex.: HEIC, que o Gemini aceita), os bytes originais são mantidos.
+    """
+    if not IMAGE_PREPROCESS:
+        return PreprocessResult(image_data, content_type, len(image_data), len(image_data), 0.0)
+
+    started = time.perf_counter()
+    try:
+        image = prepare(image_data, max_edge)
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    except UNREADABLE_IMAGE_ERRORS as e:
+        PREPROCESS_SKIPPED.inc()
+        logger.info("Imagem %s enviada sem pré-processamento: %s", content_type, e)
+        return PreprocessResult(image_data, content_type, len(image_data), len(image_data), 0.0)
+    processed = output.getvalue()
+
+    if len(processed) < len(image_data):
+        result = PreprocessResult(processed, "image/jpeg", len(image_data), len(processed),
+                                  time.perf_counter() - started)
+    else:
+        result = PreprocessResult(image_data, content_type, len(image_data), len(image_data),
+                                  time.perf_counter() - started)
+
+    record(result)
+    return result
+
+
+def record(result: PreprocessResult) -> None:
+    """
+    Registra tamanhos e tempo do pré-processamento nas métricas e no log.
+    """
+    PREPROCESS_TOTAL.inc()
+    PREPROCESS_SECONDS.inc(result.seconds)
+    BYTES_IN.inc(result.original_bytes)
+    BYTES_OUT.inc(result.processed_bytes)
+    logger.info(
+        "Imagem pré-processada: %d -> %d bytes em %.1f ms",
+        result.original_bytes, result.processed_bytes, result.seconds * 1000,
+    )
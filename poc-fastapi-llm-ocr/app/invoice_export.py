@@ -0,0 +1,225 @@
+import csv
+import importlib.util
+import io
+import json
+import os
+import zlib
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+
+from app import metrics
+from app.models import Invoice
+
+# Exportação de notas em CSV, NDJSON ou Parquet: as linhas vêm do banco em blocos de
+# EXPORT_CHUNK_ROWS por um cursor do lado do servidor e cada bloco é enviado assim que fica pronto,
+# então a memória usada não depende do número de notas exportadas.
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+FORMATS = ("csv", "ndjson", "parquet")
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Colunas exportadas, na ordem do arquivo
+COLUMNS = ("id", "cnpj", "data_emissao", "data_emissao_iso", "valor_total", "status", "imagem_hash")
+
+EXPORT_ROWS = metrics.counter("invoice_export_rows_total", "Notas enviadas por /invoices/export.")
+EXPORT_BYTES = metrics.counter("invoice_export_bytes_total", "Bytes enviados por /invoices/export (após compressão).")
+
+
+def check_format(format: str, compress: Optional[str]) -> None:
+    """
+    Valida formato e compressão antes de a resposta começar (depois disso não há como devolver erro).
+    """
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato inválido: {format} (use {', '.join(FORMATS)}).")
+    if compress not in (None, "gzip"):
+        raise HTTPException(status_code=400, detail=f"Compressão inválida: {compress} (use gzip).")
+    # pyarrow é opcional: sem ele só CSV e NDJSON
+    if format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise HTTPException(status_code=415, detail="Exportação em Parquet indisponível: instale o pacote pyarrow.")
+
+
+def filename(format: str, compress: Optional[str]) -> str:
+    # no Parquet a compressão é interna ao arquivo
+    suffix = ".gz" if compress and format != "parquet" else ""
+    return f"invoices.{format}{suffix}"
+
+
+def media_type(format: str, compress: Optional[str]) -> str:
+    return "application/gzip" if compress and format != "parquet" else MEDIA_TYPES[format]
+
+
+def export_statement(statement):
+    """
+    Seleciona só as colunas exportadas (sem montar objetos Invoice), em ordem de id,
+    lidas do cursor em blocos de EXPORT_CHUNK_ROWS.
+    """
+    return (
+        statement.with_only_columns(
+            Invoice.id, Invoice.cnpj, Invoice.data_emissao, Invoice.data_emissao_iso,
+            Invoice.valor_total_centavos, Invoice.valor_total, Invoice.status, Invoice.imagem_hash,
+        )
+        .order_by(Invoice.id)
+        .execution_options(yield_per=EXPORT_CHUNK_ROWS)
+    )
+
+
+def _record(row) -> tuple:
+    # sem centavos (valor antigo ou não reconhecido na gravação) vai o texto gravado em valor_total
+    valor = row.valor_total_centavos / 100 if row.valor_total_centavos is not None else row.valor_total
+    return (row.id, row.cnpj, row.data_emissao, row.data_emissao_iso, valor, row.status, row.imagem_hash)
+
+
+class CsvEncoder:
+    def header(self) -> bytes:
+        return self.rows([COLUMNS])
+
+    def rows(self, records) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        for record in records:
+            writer.writerow(["" if value is None else value for value in record])
+        return buffer.getvalue().encode("utf-8")
+
+    def footer(self) -> bytes:
+        return b""
+
+
+class NdjsonEncoder:
+    def header(self) -> bytes:
+        return b""
+
+    def rows(self, records) -> bytes:
+        return "".join(
+            json.dumps(dict(zip(COLUMNS, record)), ensure_ascii=False, default=str) + "\n" for record in records
+        ).encode("utf-8")
+
+    def footer(self) -> bytes:
+        return b""
+
+
+class _Sink:
+    """
+    Destino do ParquetWriter que guarda só os bytes ainda não enviados.
+    """
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+def _as_float(value) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class ParquetEncoder:
+    """
+    Cada bloco de linhas vira um row group; o rodapé do Parquet é escrito no fim. A coluna
+    valor_total é numérica: um valor_total gravado como texto que não é número fica nulo.
+    """
+
+    def __init__(self, compression: str = "snappy"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._schema = pa.schema([
+            ("id", pa.int64()),
+            ("cnpj", pa.string()),
+            ("data_emissao", pa.string()),
+            ("data_emissao_iso", pa.date32()),
+            ("valor_total", pa.float64()),
+            ("status", pa.string()),
+            ("imagem_hash", pa.string()),
+        ])
+        self._sink = _Sink()
+        self._writer = pq.ParquetWriter(self._sink, self._schema, compression=compression)
+
+    def header(self) -> bytes:
+        return self._sink.drain()
+
+    def rows(self, records) -> bytes:
+        columns = list(zip(*records))
+        valor = COLUMNS.index("valor_total")
+        columns[valor] = [_as_float(value) for value in columns[valor]]
+        self._writer.write_table(self._pa.Table.from_arrays(
+            [self._pa.array(values, type=field.type) for values, field in zip(columns, self._schema)],
+            schema=self._schema,
+        ))
+        return self._sink.drain()
+
+    def footer(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+def _encoder(format: str, compress: Optional[str]):
+    if format == "csv":
+        return CsvEncoder()
+    if format == "ndjson":
+        return NdjsonEncoder()
+    return ParquetEncoder(compression="gzip" if compress else "snappy")
+
+
+async def export_rows(session, statement, format: str, compress: Optional[str] = None) -> AsyncIterator[bytes]:
+    """
+    Produz o arquivo exportado em pedaços, um por bloco de linhas lido do cursor. Com compress="gzip",
+    CSV e NDJSON saem comprimidos em gzip durante o envio; no Parquet a compressão das colunas passa
+    a ser gzip.
+    """
+    encoder = _encoder(format, compress)
+    gzip = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if compress and format != "parquet" else None
+
+    def output(data: bytes) -> bytes:
+        if gzip is not None:
+            data = gzip.compress(data)
+        EXPORT_BYTES.inc(len(data))
+        return data
+
+    if data := output(encoder.header()):
+        yield data
+
+    result = await session.stream(export_statement(statement))
+    try:
+        async for rows in result.partitions():
+            EXPORT_ROWS.inc(len(rows))
+            if data := output(encoder.rows([_record(row) for row in rows])):
+                yield data
+    finally:
+        await result.close()
+
+    data = output(encoder.footer())
+    if gzip is not None:
+        tail = gzip.flush()
+        EXPORT_BYTES.inc(len(tail))
+        data += tail
+    if data:
+        yield data
@@ -0,0 +1,97 @@
+import re
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Optional
+
+# Formatos de data aceitos na extração/cadastro; o primeiro é o gravado em data_emissao
+DATE_FORMATS = ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y")
+
+
+def parse_data_emissao(value) -> Optional[date]:
+    """
+    Converte a data de emissão (DD/MM/AAAA ou ISO) para date. Retorna None se não for reconhecida.
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _other_mark(mark: str) -> str:
+    return "," if mark == "." else "."
+
+
+def _normalize_valor(text: str, strict: bool = False) -> Optional[str]:
+    """
+    Reescreve o valor com "." decimal e sem separador de milhar. O "," ou "." mais à direita é a marca
+    decimal quando tem 1 ou 2 dígitos depois dele; caso contrário é separador de milhar. Grupos de milhar
+    fora do padrão (ou o mesmo sinal usado como milhar e decimal) tornam o valor ambíguo: retorna None.
+    Com `strict`, um único separador seguido de 3 dígitos ("1.234") também é ambíguo.
+    """
+    match = re.fullmatch(r"(-?)([\d.,]+)", text)
+    if not match:
+        return None
+    sign, body = match.groups()
+    last = max(body.rfind(","), body.rfind("."))
+    if last < 0:
+        return sign + body
+
+    mark, integer, fraction = body[last], body[:last], body[last + 1:]
+    if len(fraction) in (1, 2) and fraction.isdigit():
+        thousands = "." if mark == "," else ","
+    else:
+        # sem parte decimal: o último sinal separa milhares
+        if strict and body.count(mark) == 1 and _other_mark(mark) not in body:
+            return None
+        thousands, integer, fraction = mark, body, ""
+
+    if _other_mark(thousands) in integer:
+        return None
+    if thousands in integer:
+        if not re.fullmatch(rf"\d{{1,3}}(?:{re.escape(thousands)}\d{{3}})+", integer):
+            return None
+        integer = integer.replace(thousands, "")
+    elif not integer.isdigit():
+        return None
+    return f"{sign}{integer}.{fraction}" if fraction else sign + integer
+
+
+def parse_valor_centavos(value, strict: bool = False) -> Optional[int]:
+    """
+    Converte o valor total para centavos (inteiro, sem erro de ponto flutuante).
+    Aceita números e textos com "," ou "." decimal e separador de milhar. Retorna None se não for
+    reconhecido ou se for ambíguo; com `strict` (texto vindo do LLM), "1.234" também é ambíguo.
+
+    >>> [parse_valor_centavos(v) for v in ("1234.56", "1.234,56", "R$ 1.234,56", "1,234.56", "0,5")]
+    [123456, 123456, 123456, 123456, 50]
+    >>> [parse_valor_centavos(v) for v in ("1.234", "12.345.678", "1,234,567", "-10,00", 89.9)]
+    [123400, 1234567800, 123456700, -1000, 8990]
+    >>> [parse_valor_centavos(v) for v in ("1.2345", "1,234.567", "1.234.56", "12.34.567", "abc", "1.", "")]
+    [None, None, None, None, None, None, None]
+    >>> [parse_valor_centavos(v, strict=True) for v in ("1.234", "1,234", "1.234,56", "12.345.678", 1.234)]
+    [None, None, 123456, 1234567800, 123]
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        number = Decimal(str(value))
+    else:
+        text = _normalize_valor(re.sub(r"[^\d,.\-]", "", str(value)), strict)
+        if text is None:
+            return None
+        try:
+            number = Decimal(text)
+        except InvalidOperation:
+            return None
+    if not number.is_finite():
+        return None
+    return int((number * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
@@ -0,0 +1,121 @@
+import base64
+import json
+from datetime import date
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_
+
+from app.models import Invoice
+
+# Ordenação e filtros usam as colunas tipadas e indexadas
+SORT_COLUMNS = {
+    "id": Invoice.id,
+    "data_emissao": Invoice.data_emissao_iso,
+    "valor_total": Invoice.valor_total_centavos,
+}
+
+# Tamanho da página quando só o cursor é informado
+DEFAULT_LIMIT = 100
+
+
+def apply_filters(query, status: Optional[str] = None, cnpj: Optional[str] = None,
+                  data_inicio: Optional[date] = None, data_fim: Optional[date] = None):
+    """
+    Aplica os filtros da listagem de notas (status, CNPJ e intervalo de emissão).
+    """
+    if status:
+        query = query.filter(Invoice.status == status)
+    if cnpj:
+        query = query.filter(Invoice.cnpj == cnpj)
+    if data_inicio:
+        query = query.filter(Invoice.data_emissao_iso >= data_inicio)
+    if data_fim:
+        query = query.filter(Invoice.data_emissao_iso <= data_fim)
+    return query
+
+
+def encode_cursor(value, invoice_id: int) -> str:
+    if isinstance(value, date):
+        value = value.isoformat()
+    raw = json.dumps([value, invoice_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, invoice_id = json.loads(base64.urlsafe_b64decode(padded))
+        return value, int(invoice_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+
+
+def _sort_key(sort: str):
+    descending = sort.startswith("-")
+    name = sort.lstrip("-")
+    if name not in SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Ordenação inválida: {sort}.")
+    return name, SORT_COLUMNS[name], descending
+
+
+def _after(column, value, invoice_id: int, descending: bool):
+    """
+    Condição de keyset "depois de (value, id)", com NULL sempre por último (ver `_order_by`).
+    """
+    if column is Invoice.id:
+        return Invoice.id < invoice_id if descending else Invoice.id > invoice_id
+
+    id_after = Invoice.id < invoice_id if descending else Invoice.id > invoice_id
+    if value is None:
+        return and_(column.is_(None), id_after)
+    value_after = column < value if descending else column > value
+    return or_(value_after, and_(column == value, id_after), column.is_(None))
+
+
+def _order_by(column, descending: bool) -> list:
+    """
+    Ordenação por (coluna, id) com NULL por último nos dois sentidos. A posição padrão de NULL varia
+    entre bancos (primeiro no SQLite em ASC, último no PostgreSQL), então ela é explícita: o
+    "coluna IS NULL" vem antes da coluna, o que funciona em SQLite, PostgreSQL e MySQL.
+    """
+    if column is Invoice.id:
+        return [Invoice.id.desc() if descending else Invoice.id.asc()]
+    if descending:
+        return [column.is_(None).asc(), column.desc(), Invoice.id.desc()]
+    return [column.is_(None).asc(), column.asc(), Invoice.id.asc()]
+
+
+def page_statement(statement, sort: str = "id", cursor: Optional[str] = None, limit: Optional[int] = DEFAULT_LIMIT):
+    """
+    Paginação por keyset sobre (coluna de ordenação, id): o custo de cada página não depende
+    de quantas páginas vieram antes. Recebe um select(Invoice) já filtrado e retorna o select
+    da página, com uma linha a mais para saber se existe a próxima (ver `split_page`).
+    Com `limit=None` retorna todas as notas a partir do cursor, sem paginar.
+    """
+    name, column, descending = _sort_key(sort)
+
+    if cursor:
+        value, invoice_id = decode_cursor(cursor)
+        if name == "data_emissao" and value is not None:
+            try:
+                value = date.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="Cursor inválido.")
+        statement = statement.filter(_after(column, value, invoice_id, descending))
+
+    statement = statement.add_columns(column.label("_sort_value")).order_by(*_order_by(column, descending))
+    return statement if limit is None else statement.limit(limit + 1)
+
+
+def split_page(rows, limit: Optional[int] = DEFAULT_LIMIT):
+    """
+    Separa as linhas de `page_statement` em (notas, cursor da próxima página ou None).
+    """
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last_invoice, last_value = rows[-1]
+        next_cursor = encode_cursor(last_value, last_invoice.id)
+
+    return [invoice for invoice, _ in rows], next_cursor
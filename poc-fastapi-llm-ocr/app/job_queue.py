@@ -0,0 +1,198 @@
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, or_, update
+
+from app.models import ExtractionJob, Invoice
+
+logger = logging.getLogger(__name__)
+
+# Fila de extração persistida no SQLite (tabela extraction_jobs).
+#
+# Ciclo de vida do job:        QUEUED -> LEASED -> DONE
+#                                 ^         |
+#                                 +---------+ (falha com tentativas restantes)
+#                                           |
+#                                           +-> DEAD (tentativas esgotadas)
+#
+# Status da nota associada:    PEDENTE (na fila) -> CHECKING (em extração) -> PROCESSADO
+#                              ERRO quando o job vai para DEAD.
+
+# Tempo em que o job fica invisível para outros workers após ser reservado.
+# Se o worker morrer sem concluir, o job volta a ficar disponível depois disso.
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Espera base (s) antes de uma nova tentativa; dobra a cada falha.
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "5"))
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _set_invoice_status(session, invoice_id: int, status: str) -> None:
+    session.execute(update(Invoice).where(Invoice.id == invoice_id).values(status=status))
+
+
+def enqueue(session, image_data: bytes, filename: str, content_type: str, imagem_hash: str,
+            imagem_phash: str | None = None) -> ExtractionJob:
+    """
+    Grava a nota (status PEDENTE) e o job com a imagem na mesma transação.
+    """
+    now = _now()
+    invoice = Invoice(imagem_hash=imagem_hash, imagem_phash=imagem_phash, status="PEDENTE")
+    session.add(invoice)
+    session.flush()
+
+    job = ExtractionJob(
+        invoice_id=invoice.id,
+        filename=filename,
+        content_type=content_type,
+        payload=image_data,
+        status="QUEUED",
+        attempts=0,
+        max_attempts=JOB_MAX_ATTEMPTS,
+        available_at=now,
+        created_at=now,
+        updated_at=now,
+    )
+    session.add(job)
+    session.commit()
+    return job
+
+
+def _dead_letter_expired(session, now: datetime) -> None:
+    """
+    Jobs cujo worker morreu na última tentativa não voltam para a fila: vão para DEAD.
+    """
+    expired = session.query(ExtractionJob).filter(
+        ExtractionJob.status == "LEASED",
+        ExtractionJob.lease_expires_at < now,
+        ExtractionJob.attempts >= ExtractionJob.max_attempts,
+    ).all()
+    for job in expired:
+        job.status = "DEAD"
+        job.last_error = job.last_error or "Tempo de processamento esgotado."
+        job.lease_owner = None
+        job.lease_expires_at = None
+        job.updated_at = now
+        _set_invoice_status(session, job.invoice_id, "ERRO")
+    if expired:
+        session.commit()
+
+
+def lease(session, owner: str):
+    """
+    Reserva o próximo job disponível para o worker `owner`, ou retorna None se a fila estiver vazia.
+
+    A reserva é um UPDATE condicional: se outro worker pegar o mesmo job primeiro,
+    o rowcount é zero e tentamos o próximo candidato.
+    """
+    now = _now()
+    _dead_letter_expired(session, now)
+
+    ready = or_(
+        and_(ExtractionJob.status == "QUEUED", ExtractionJob.available_at <= now),
+        and_(ExtractionJob.status == "LEASED", ExtractionJob.lease_expires_at < now),
+    )
+
+    while True:
+        candidate_id = (
+            session.query(ExtractionJob.id)
+            .filter(ready)
+            .order_by(ExtractionJob.id)
+            .limit(1)
+            .scalar()
+        )
+        if candidate_id is None:
+            return None
+
+        result = session.execute(
+            update(ExtractionJob)
+            .where(ExtractionJob.id == candidate_id, ready)
+            .values(
+                status="LEASED",
+                lease_owner=owner,
+                lease_expires_at=now + timedelta(seconds=JOB_VISIBILITY_TIMEOUT),
+                attempts=ExtractionJob.attempts + 1,
+                updated_at=now,
+            )
+        )
+        if result.rowcount != 1:
+            session.rollback()
+            continue
+
+        job = session.get(ExtractionJob, candidate_id, populate_existing=True)
+        _set_invoice_status(session, job.invoice_id, "CHECKING")
+        session.commit()
+        return job
+
+
+def _release(session, job: ExtractionJob, owner: str, **values) -> bool:
+    """
+    Encerra a reserva do job com um UPDATE condicional ao dono da reserva. Se ela expirou e outro
+    worker pegou o job, o rowcount é zero: nada é gravado e retorna False.
+    """
+    result = session.execute(
+        update(ExtractionJob)
+        .where(ExtractionJob.id == job.id, ExtractionJob.status == "LEASED", ExtractionJob.lease_owner == owner)
+        .values(lease_owner=None, lease_expires_at=None, updated_at=_now(), **values)
+    )
+    if result.rowcount != 1:
+        session.rollback()
+        logger.warning("Job %s: reserva de %s expirou e o job foi reservado por outro worker; resultado descartado.",
+                       job.id, owner)
+        return False
+    return True
+
+
+def complete(session, job: ExtractionJob, owner: str, json_data: dict) -> bool:
+    """
+    Grava os dados extraídos na nota e encerra o job. A imagem é descartada da fila.
+    Retorna False se a reserva não pertence mais a `owner`.
+    """
+    if not _release(session, job, owner, status="DONE", payload=None, last_error=None):
+        return False
+
+    invoice = session.get(Invoice, job.invoice_id)
+    if invoice:
+        invoice.cnpj = json_data.get('cnpj')
+        invoice.data_emissao = json_data.get('data')
+        invoice.valor_total = json_data.get('valor')
+        invoice.status = "PROCESSADO"
+    session.commit()
+    return True
+
+
+def fail(session, job: ExtractionJob, owner: str, error: str) -> bool:
+    """
+    Registra a falha. Com tentativas restantes o job volta à fila com backoff exponencial;
+    caso contrário vai para DEAD e a nota fica com status ERRO.
+    Retorna False se a reserva não pertence mais a `owner`.
+    """
+    last_error = (error or "")[:1024]
+    if job.attempts >= job.max_attempts:
+        if not _release(session, job, owner, status="DEAD", last_error=last_error):
+            return False
+        _set_invoice_status(session, job.invoice_id, "ERRO")
+    else:
+        available_at = _now() + timedelta(seconds=JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1))
+        if not _release(session, job, owner, status="QUEUED", available_at=available_at, last_error=last_error):
+            return False
+        _set_invoice_status(session, job.invoice_id, "PEDENTE")
+    session.commit()
+    return True
+
+
+def requeue(session, job: ExtractionJob) -> None:
+    """
+    Devolve um job DEAD para a fila, zerando as tentativas.
+    """
+    now = _now()
+    job.status = "QUEUED"
+    job.attempts = 0
+    job.available_at = now
+    job.updated_at = now
+    _set_invoice_status(session, job.invoice_id, "PEDENTE")
+    session.commit()
@@ -0,0 +1,161 @@
+import json
+import logging
+import re
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+
+from app import metrics
+from app.env_util import env_flag
+from app.invoice_fields import parse_valor_centavos
+
+logger = logging.getLogger(__name__)
+
+# Pede ao modelo saída JSON estruturada (response_mime_type no Gemini, response_format no Mistral).
+# Desative para modelos que não suportam o modo JSON.
+LLM_JSON_MODE = env_flag("LLM_JSON_MODE", "true")
+
+# Campos que o modelo devolve; viram cnpj / data_emissao / valor_total de InvoiceResponse
+INVOICE_FIELDS = ("cnpj", "data", "valor")
+
+INVOICE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "cnpj": {"type": "string", "nullable": True, "description": "CNPJ do emitente, somente números"},
+        "data": {"type": "string", "nullable": True, "description": "Data de emissão no formato DD/MM/AAAA"},
+        "valor": {"type": "number", "nullable": True, "description": "Valor total pago da nota"},
+    },
+    "required": list(INVOICE_FIELDS),
+}
+
+# generation_config do Gemini: a resposta vem como JSON no formato de INVOICE_SCHEMA
+GEMINI_GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": INVOICE_SCHEMA}
+
+# O Mistral usa JSON Schema padrão: null entra no tipo em vez de "nullable"
+MISTRAL_INVOICE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        name: {"type": [spec["type"], "null"], "description": spec["description"]}
+        for name, spec in INVOICE_SCHEMA["properties"].items()
+    },
+    "required": list(INVOICE_FIELDS),
+    "additionalProperties": False,
+}
+MISTRAL_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "invoice", "schema": MISTRAL_INVOICE_SCHEMA, "strict": True},
+}
+
+REASK_PROMPT = (
+    "A resposta abaixo deveria ser um objeto JSON com as chaves \"cnpj\" (string só com números ou null), "
+    "\"data\" (string DD/MM/AAAA ou null) e \"valor\" (número com ponto decimal ou null), mas não pôde ser lida. "
+    "Reescreva-a como esse objeto JSON, sem nenhum texto antes ou depois.\n\nResposta:\n"
+)
+
+PARSE_TOTAL = metrics.counter("llm_json_parse_total", "Respostas de extração do LLM interpretadas como JSON.")
+PARSE_FAILURES = metrics.counter("llm_json_parse_failures_total", "Respostas de extração do LLM que não eram JSON válido.")
+REASKS = metrics.counter("llm_json_reasks_total", "Novas chamadas ao LLM para corrigir uma resposta que não era JSON.")
+PARSE_SECONDS = metrics.histogram("llm_json_parse_seconds", "Tempo para interpretar a resposta de extração do LLM como JSON.")
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_decoder = json.JSONDecoder()
+
+
+def _find_object(text: str) -> Optional[dict]:
+    """
+    Procura o JSON na resposta: o texto inteiro, um bloco ```json```, ou o primeiro objeto {...} no meio do texto.
+    """
+    text = text.strip().lstrip("\ufeff")
+    candidates = [text] + [match.strip() for match in _FENCE.findall(text)]
+    for candidate in candidates:
+        try:
+            value = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, dict):
+            return value
+
+    start = text.find("{")
+    while start != -1:
+        try:
+            value, _ = _decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            value = None
+        if isinstance(value, dict):
+            return value
+        start = text.find("{", start + 1)
+    return None
+
+
+def _normalize(data: dict) -> dict:
+    result = {field: data.get(field) for field in INVOICE_FIELDS}
+    for field in ("cnpj", "data"):
+        if result[field] is not None:
+            result[field] = str(result[field]).strip() or None
+    # valor como float (aceita também "1.234,56" e "R$ 123,45"); None se não for número ou se o
+    # texto for ambíguo ("1.234" pode ser mil ou um real): melhor pedir conferência que gravar errado
+    centavos = parse_valor_centavos(result["valor"], strict=True)
+    result["valor"] = centavos / 100 if centavos is not None else None
+    return result
+
+
+def parse_invoice_json(raw: str) -> Optional[dict]:
+    """
+    Interpreta a resposta de extração do LLM. Retorna {cnpj, data, valor} ou None se não houver JSON.
+    """
+    PARSE_TOTAL.inc()
+    with PARSE_SECONDS.time():
+        data = _find_object(raw or "")
+    if data is None:
+        PARSE_FAILURES.inc()
+        return None
+    return _normalize(data)
+
+
+def _parse_error(raw: str) -> HTTPException:
+    logger.warning("Não foi possível parsear o JSON da resposta do LLM: %s", raw)
+    return HTTPException(
+        status_code=500,
+        detail=f"Erro ao parsear a resposta do modelo. Resposta recebida: {(raw or '').strip()}"
+    )
+
+
+def parse_with_reask(raw: str, reask: Callable[[str], str]) -> dict:
+    """
+    Interpreta a resposta; se não for JSON, faz uma única nova chamada (`reask`, só texto, sem a imagem)
+    pedindo que a própria resposta seja reescrita como JSON.
+    """
+    data = parse_invoice_json(raw)
+    if data is not None:
+        return data
+
+    REASKS.inc()
+    try:
+        retry = reask(REASK_PROMPT + (raw or ""))
+    except Exception as e:
+        logger.warning("Falha ao pedir a correção do JSON ao LLM: %s", e)
+        raise _parse_error(raw)
+    data = parse_invoice_json(retry)
+    if data is None:
+        raise _parse_error(retry)
+    return data
+
+
+async def parse_with_reask_async(raw: str, reask: Callable[[str], Awaitable[str]]) -> dict:
+    """
+    Versão de `parse_with_reask` para chamadas assíncronas (Mistral).
+    """
+    data = parse_invoice_json(raw)
+    if data is not None:
+        return data
+
+    REASKS.inc()
+    try:
+        retry = await reask(REASK_PROMPT + (raw or ""))
+    except Exception as e:
+        logger.warning("Falha ao pedir a correção do JSON ao LLM: %s", e)
+        raise _parse_error(raw)
+    data = parse_invoice_json(retry)
+    if data is None:
+        raise _parse_error(retry)
+    return data
@@ -1,20 +1,33 @@
 import os
 from dotenv import load_dotenv
 import json
-from fastapi import Depends, FastAPI, HTTPException, UploadFile, File, Form  
-from fastapi.responses import JSONResponse
+import io
+import asyncio
+import time
+import mimetypes
+import zipfile
+import zlib
+from datetime import date
+from fastapi import Depends, FastAPI, HTTPException, UploadFile, File, Form, Query, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 import google.generativeai as genai
-from app.database import Base, engine, SessionLocal
-from sqlalchemy.orm import Session 
-from app.schemas import ChatRequest, ChatResponse, ConfigurationRequest, ConfigurationResponse, InvoiceRequest, InvoiceResponse, PromptRequest
-from app.models import Configurations, Invoice
+from app.database import engine, async_engine, SessionLocal, AsyncSessionLocal
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from app.schemas import ChatRequest, ChatResponse, ConfigurationRequest, ConfigurationResponse, InvoiceRequest, InvoiceResponse, JobResponse, PromptRequest
+from app.models import Configurations, ExtractionJob, Invoice
 import logging
-from app.hash_util import gerar_hash_imagem # <-- Import logging
+from app.hash_util import gerar_dhash_imagem, gerar_hash_imagem # <-- Import logging
+from app.image_preprocess import preprocess_image
 from fastapi.middleware.cors import CORSMiddleware
-import requests  # Certo!
-from requests.exceptions import RequestException  # Importa a exceção corretamente
-from PIL import Image
-import pytesseract
+from contextlib import asynccontextmanager
+import httpx
+from app import cassette, config_cache, documents, hedging, http_client, image_preprocess, invoice_export, invoice_query, job_queue, llm_json, metrics, model_registry, ocr, phash_index, resilience, response_cache
+from app.migrations import run_migrations
 
 
 # --- Logging Setup ---
@@ -34,11 +47,44 @@ if not API_KEY:
         "Por favor, defina sua chave de API do Google Gemini."
     )
 
-genai.configure(api_key=API_KEY)
+# Endpoint alternativo da API do Gemini (ex.: o servidor falso de benchmarks/stub_llm.py); usa o transporte REST
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+if GEMINI_API_ENDPOINT:
+    genai.configure(api_key=API_KEY, transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+else:
+    genai.configure(api_key=API_KEY)
 GEMINI_MODEL = "gemini-2.0-flash"
 GEMINI_PRO_VISION_MODEL = "gemini-1.5-flash" # Modelo para processamento de imagem  gemini-pro-vision gemini-1.5-flash
+# Sem a retentativa interna do SDK (que repete 503 por até 10 min): as novas tentativas ficam com app.resilience
+GEMINI_REQUEST_OPTIONS = {"retry": None}
+
+# Tamanho máximo aceito por imagem enviada (e por arquivo ZIP no lote)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_ZIP_UPLOAD_BYTES = int(os.getenv("MAX_ZIP_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+
+# Extração em lote: extrações simultâneas por requisição e tamanho máximo do lote
+EXTRACT_BATCH_CONCURRENCY = int(os.getenv("EXTRACT_BATCH_CONCURRENCY", "4"))
+EXTRACT_BATCH_MAX_CONCURRENCY = int(os.getenv("EXTRACT_BATCH_MAX_CONCURRENCY", "16"))
+EXTRACT_BATCH_MAX_FILES = int(os.getenv("EXTRACT_BATCH_MAX_FILES", "500"))
+# Soma máxima (bytes) das imagens de um lote, contando as de arquivos ZIP pelo tamanho descompactado
+EXTRACT_BATCH_MAX_BYTES = int(os.getenv("EXTRACT_BATCH_MAX_BYTES", str(500 * 1024 * 1024)))
+
+LLM_CALLS_AVOIDED = metrics.counter(
+    "llm_calls_avoided_total", "Extrações resolvidas pelo hash da imagem sem chamar o LLM."
+)
+NEAR_DUPLICATES_FOUND = metrics.counter(
+    "near_duplicates_found_total", "Imagens semelhantes (hash perceptual) a uma nota já cadastrada."
+)
+# Tempo de cada etapa da extração (upload_read, hash, dedup_query, near_duplicate, config_lookup,
+# preprocess, ocr, llm_gemini, llm_mistral, db_commit) e da extração inteira (total)
+STAGE_SECONDS = metrics.histogram(
+    "extraction_stage_seconds", "Duração de cada etapa da extração de notas.", labelnames=("stage",)
+)
+EXTRACTIONS_IN_FLIGHT = metrics.gauge("extractions_in_flight", "Extrações de notas em andamento.")
+UPLOADS = metrics.counter("uploads_total", "Arquivos recebidos por upload.")
+UPLOAD_BYTES = metrics.counter("upload_bytes_total", "Bytes recebidos por upload.")
 
-Base.metadata.create_all(engine)
+run_migrations(engine)
 def get_session():
     session = SessionLocal()
     try:
@@ -46,11 +92,37 @@ def get_session():
     finally:
         session.close()
 
+async def get_async_session():
+    """
+    Sessão assíncrona para as rotas async: as consultas não bloqueiam o event loop.
+    Código síncrono que recebe uma sessão roda via `await session.run_sync(func, ...)`.
+    """
+    async with AsyncSessionLocal() as session:
+        yield session
+
 origins = [
         "http://localhost:4200","http://localhost:9000"  # frontend URL
 ]
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cliente HTTP com pool de conexões compartilhado pelas rotas do Mistral
+    await http_client.open_client()
+    # Pool de processos para o OCR (Tesseract)
+    ocr.start_pool()
+    # Pool de processos que rasteriza as páginas de PDF/TIFF
+    documents.start_pool()
+    # Índice de hashes perceptuais das notas já cadastradas
+    with SessionLocal() as session:
+        phash_index.index.refresh(session)
+    yield
+    ocr.shutdown_pool()
+    documents.shutdown_pool()
+    await http_client.close_client()
+    await async_engine.dispose()
+
 app = FastAPI(
+    lifespan=lifespan,
     title="API METAMIND - Extração Inteligente ",
     description="Extração inteligente de dados.",
     version="1.0.0",
@@ -62,6 +134,14 @@ app = FastAPI(
     {
          "name": "Crud",
          "description": "Operações de CRUD.",
+    },
+    {
+         "name": "Fila de extração",
+         "description": "Extração assíncrona: envia a imagem e consulta o resultado depois.",
+    },
+    {
+         "name": "Monitoramento",
+         "description": "Contadores de uso da API.",
     }]
 )
 
@@ -71,12 +151,61 @@ app.add_middleware(
         #allow_credentials=True,
         allow_methods=["*"],  # Allows all HTTP methods
         allow_headers=["*"],  # Allows all headers
+        expose_headers=["X-Next-Cursor", "X-Total-Count"],  # paginação de GET /invoices
 )
 
+async def read_upload(file: UploadFile, limit: int = MAX_UPLOAD_BYTES) -> bytes:
+    """
+    Lê o upload para memória, recusando com 413 arquivos maiores que `limit`.
+    """
+    with STAGE_SECONDS.time(stage="upload_read"):
+        data = await file.read(limit + 1)
+    UPLOADS.inc()
+    UPLOAD_BYTES.inc(len(data))
+    if len(data) > limit:
+        raise HTTPException(status_code=413, detail=f"O arquivo excede o limite de {limit} bytes.")
+    return data
+
+# Respostas em streaming (server-sent events): sem cache e sem buffering em proxies (nginx)
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_event(data: dict | str, event: str | None = None) -> str:
+    """
+    Formata um evento SSE. Dicionários são enviados como JSON em uma única linha `data:`.
+    """
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {payload}\n\n"
+
+def record_gemini_usage(response) -> None:
+    """
+    Soma os tokens informados pelo Gemini (usage_metadata) nas métricas do provedor.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        resilience.gemini.record_usage(getattr(usage, "prompt_token_count", 0), getattr(usage, "candidates_token_count", 0))
+
+def gemini_payload(response) -> dict:
+    """
+    Partes de texto da resposta do Gemini, no formato gravado pelo cassete (app.cassette).
+    """
+    return {"parts": [part.text for part in response.parts if hasattr(part, 'text')]}
+
+def record_mistral_usage(data: dict) -> None:
+    """
+    Soma os tokens informados pelo Mistral (campo usage) nas métricas do provedor.
+    """
+    usage = data.get("usage") or {}
+    resilience.mistral.record_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+
 # --- Endpoint da API ---
 
 @app.post("/chat/mistral", response_model=ChatResponse,tags=["Interação com LLM"])
-def chat_with_mistral(request_data: ChatRequest):
+async def chat_with_mistral(
+    request_data: ChatRequest,
+    http_response: Response,
+    cache: bool | None = Query(None, description="true força o uso do cache de respostas mesmo com temperatura > 0; false o ignora"),
+):
     """
     Endpoint que recebe uma requisição de chat e encaminha para a API do Mistral. (https://mistral.ai/)
     
@@ -100,6 +229,11 @@ def chat_with_mistral(request_data: ChatRequest):
             "stream": false
         }
 
+    Com `"stream": true` a resposta é `text/event-stream`: os eventos SSE do Mistral
+    (`data: {...}` e `data: [DONE]`) são repassados ao cliente à medida que chegam.
+
+    Requisições iguais (modelo, mensagens, temperatura e max_tokens) com temperatura 0 são respondidas
+    pelo cache de respostas; o header `X-Cache` indica HIT, MISS ou BYPASS.
     """
     url = MISTRAL_API_URL 
     headers = {
@@ -107,16 +241,99 @@ def chat_with_mistral(request_data: ChatRequest):
         "Content-Type": "application/json"
     }
     payload = request_data.dict()
+
+    if request_data.stream:
+        response_cache.CACHE_BYPASS.inc()
+        return await stream_mistral(url, headers, payload)
+
+    cache_key = None
+    if response_cache.should_cache(request_data.temperature, cache):
+        cache_key = response_cache.make_key("mistral", {
+            "model": request_data.model,
+            "messages": payload["messages"],
+            "temperature": request_data.temperature,
+            "max_tokens": request_data.max_tokens,
+        })
+        cached = await response_cache.cache.get(cache_key)
+        if cached is not None:
+            http_response.headers["X-Cache"] = "HIT"
+            return ChatResponse(response=cached)
     
-    try:
-        resp = requests.post(url, headers=headers, json=payload)
+    async def post():
+        resp = await http_client.get_client().post(url, headers=headers, json=payload)
         resp.raise_for_status()
-    except requests.RequestException as e:
+        data = resp.json()
+        record_mistral_usage(data)
+        return data
+
+    tokens = resilience.estimate_tokens(*(m.get("content", "") for m in payload["messages"]), max_tokens=request_data.max_tokens or 0)
+    try:
+        # no modo de gravação/replay (LLM_PROVIDER_MODE) a resposta vem do cassete
+        data = await cassette.through(
+            cassette.make_key("mistral", "chat", payload), "mistral",
+            lambda: resilience.mistral.call(post, tokens=tokens),
+        )
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Erro na requisição para a API do Mistral: {e}")
     
-    data = resp.json()
+    if cache_key:
+        await response_cache.cache.set(cache_key, data)
+    http_response.headers["X-Cache"] = "MISS" if cache_key else "BYPASS"
     return ChatResponse(response=data)
 
+async def stream_mistral(url: str, headers: dict, payload: dict) -> StreamingResponse:
+    """
+    Abre o stream do Mistral e repassa os bytes ao cliente sem acumular a resposta.
+    Erros de conexão ou HTTP do Mistral antes do primeiro byte viram HTTP 500, como no modo normal
+    (429/5xx são repetidos antes); erros no meio do stream viram um evento `error`.
+    """
+    client = http_client.get_client()
+
+    async def open_stream():
+        request = client.build_request("POST", url, headers={**headers, "Accept": "text/event-stream"}, json=payload)
+        upstream = await client.send(request, stream=True)
+        if upstream.is_error:
+            await upstream.aread()
+            await upstream.aclose()
+            upstream.raise_for_status()
+        return upstream
+
+    tokens = resilience.estimate_tokens(*(m.get("content", "") for m in payload["messages"]), max_tokens=payload.get("max_tokens") or 0)
+
+    async def open_live():
+        upstream = await resilience.mistral.call(open_stream, tokens=tokens)
+
+        async def chunks():
+            try:
+                async for chunk in upstream.aiter_bytes():
+                    yield chunk
+            finally:
+                # também fecha a conexão com o Mistral se o cliente desconectar
+                await upstream.aclose()
+
+        return chunks()
+
+    try:
+        chunks = await cassette.open_stream(cassette.make_key("mistral", "chat", payload), "mistral", open_live)
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erro na requisição para a API do Mistral: HTTP {e.response.status_code} {e.response.text}"
+        )
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Erro na requisição para a API do Mistral: {e}")
+
+    async def relay():
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except httpx.HTTPError as e:
+            yield sse_event({"erro": f"Erro no stream da API do Mistral: {e}"}, event="error")
+        finally:
+            await chunks.aclose()
+
+    return StreamingResponse(relay(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 
 @app.post("/invoices/extract/mistral",tags=["Interação com LLM"]) # , response_model=InvoiceResponse
 async def extract_invoice_data_with_mistral(
@@ -125,24 +342,54 @@ async def extract_invoice_data_with_mistral(
     """
     Recebe uma imagem de nota fiscal, extrai CNPJ, data e valor total e grava na base de notas.
     """    
-    # Salvar temporariamente
-    temp_path = f"temp_{file.filename}"
-    with open(temp_path, "wb") as f:
-        f.write(await file.read())
-
-    # Abrir imagem com Pillow e extrair texto via pytesseract
-    image = Image.open(temp_path)
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="O arquivo enviado não é uma imagem.")
 
-    logger.warning(">>> Salvou  imagem")
+    # A imagem fica só em memória: o mesmo buffer vai para o OCR e para o hash
+    image_data = await read_upload(file)
 
-    texto_ocr = pytesseract.image_to_string(image, lang="por")
+    EXTRACTIONS_IN_FLIGHT.inc()
+    try:
+        json_data = await extract_fields_with_mistral(image_data)
+    except LLMProviderError as e:
+        return JSONResponse(status_code=500, content={"erro": "Falha no modelo", "detalhe": e.detail})
+    finally:
+        EXTRACTIONS_IN_FLIGHT.dec()
 
     # gera hash imagem
-    # hash = gerar_hash_imagem(image)
+    hash = gerar_hash_imagem(image_data)
+    
+    invoiceNew = Invoice(
+        cnpj=json_data.get('cnpj'), 
+        data_emissao=json_data.get('data'), 
+        valor_total=json_data.get('valor'),
+        imagem_hash=hash,
+        status="CHECKING"
+    )
+
+    return invoiceNew
+
+class LLMProviderError(Exception):
+    """
+    Falha na chamada a um provedor de LLM (erro de rede ou resposta HTTP de erro).
+    """
+    def __init__(self, provider: str, detail: str):
+        super().__init__(f"{provider}: {detail}")
+        self.provider = provider
+        self.detail = detail
 
-    os.remove(temp_path)
+async def extract_fields_with_mistral(image_data: bytes) -> dict:
+    """
+    Extrai o texto da imagem com o Tesseract e envia ao Mistral. Retorna o JSON extraído (cnpj, data, valor).
+    """
+    started = time.perf_counter()
 
-    logger.warning(">>> Feito OCR")
+    # Extrai texto via pytesseract, em um processo do pool de OCR
+    try:
+        with STAGE_SECONDS.time(stage="ocr"):
+            texto_ocr = await ocr.image_to_string(image_data)
+    except image_preprocess.UNREADABLE_IMAGE_ERRORS:
+        raise HTTPException(status_code=400, detail="Não foi possível abrir a imagem enviada.")
 
     # Prompt para LLM
     prompt = f"""
@@ -172,59 +419,45 @@ async def extract_invoice_data_with_mistral(
         "temperature": 0.3,
         "max_tokens": 400
     }
+    if llm_json.LLM_JSON_MODE:
+        payload["response_format"] = llm_json.MISTRAL_RESPONSE_FORMAT
 
     headers = {
         "Authorization": f"Bearer {MISTRAL_API_KEY}",
         "Content-Type": "application/json"
     }
 
-    response = requests.post(MISTRAL_API_URL, headers=headers, json=payload)
-
-    if response.status_code != 200:
-        return JSONResponse(status_code=500, content={"erro": "Falha no modelo", "detalhe": response.text})
-
-    content = response.json()["choices"][0]["message"]["content"]
-
-
+    async def complete(body: dict, image: bytes | None = None) -> str:
+        async def post():
+            resp = await http_client.get_client().post(MISTRAL_API_URL, headers=headers, json=body)
+            resp.raise_for_status()
+            data = resp.json()
+            record_mistral_usage(data)
+            return data
+
+        # limite de taxa, novas tentativas em 429/5xx e circuit breaker do provedor;
+        # no modo de gravação/replay (LLM_PROVIDER_MODE) a resposta vem do cassete
+        with STAGE_SECONDS.time(stage="llm_mistral"):
+            data = await cassette.through(
+                cassette.make_key("mistral", "extract", body, image), "mistral",
+                lambda: resilience.mistral.call(post, tokens=resilience.estimate_tokens(body["messages"][0]["content"], max_tokens=body["max_tokens"])),
+            )
+        return data["choices"][0]["message"]["content"]
 
-    # Tenta extrair o JSON da resposta do LLM
-    json_data = {}
-    raw_llm_response = content
     try:
-        # Tenta encontrar o bloco JSON na resposta
-        start_index = raw_llm_response.find("```json")
-        end_index = raw_llm_response.find("```", start_index + 1)
-        
-        if start_index != -1 and end_index != -1:
-            json_string = raw_llm_response[start_index + len("```json"):end_index].strip()
-            json_data = json.loads(json_string)
-        else:
-            # Se não encontrar o bloco ```json```, tenta parsear a resposta completa
-            json_data = json.loads(raw_llm_response.strip())
-
-    except json.JSONDecodeError as e:
-        print(f"Não foi possível parsear o JSON da resposta do LLM: {raw_llm_response}. Erro: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Erro ao parsear a resposta do modelo. Resposta recebida: {raw_llm_response.strip()}"
-        )
-
-    # Converte o valor para float se não for nulo
-    if 'valor' in json_data and json_data['valor'] is not None:
-        try:
-            json_data['valor'] = float(json_data['valor'])
-        except ValueError:
-            json_data['valor'] = None # Ou manter como string se a conversão falhar
-    
-    invoiceNew = Invoice(
-        cnpj=json_data.get('cnpj'), 
-        data_emissao=json_data.get('data'), 
-        valor_total=json_data.get('valor'),
-        #imagem_hash=hash,
-        status="CHECKING"
-    )
-
-    return invoiceNew
+        content = await complete(payload, image_data)
+    except httpx.HTTPStatusError as e:
+        raise LLMProviderError("mistral", e.response.text)
+    except httpx.HTTPError as e:
+        raise LLMProviderError("mistral", str(e))
+
+    async def reask(prompt: str) -> str:
+        return await complete({**payload, "messages": [{"role": "user", "content": prompt}]})
+
+    # JSON da resposta (cnpj, data, valor); se não for JSON válido, pede a correção uma vez
+    json_data = await llm_json.parse_with_reask_async(content, reask)
+    hedging.record_latency("mistral", time.perf_counter() - started)
+    return json_data
  
     # try:
     #     return JSONResponse(content=eval(content))
@@ -234,25 +467,53 @@ async def extract_invoice_data_with_mistral(
 
 
 @app.post("/chat/gemini",tags=["Interação com LLM"])
-async def chat_with_gemini(request: PromptRequest):
+async def chat_with_gemini(
+    request: PromptRequest,
+    http_response: Response,
+    cache: bool | None = Query(None, description="true usa o cache de respostas"),
+):
     """
     Recebe um prompt de texto, interage com o modelo Google Gemini e retorna a resposta.
+    O Gemini responde com a temperatura padrão (respostas variam a cada chamada): prompts repetidos
+    só são respondidos pelo cache de respostas com `?cache=true` (header `X-Cache`).
     """
+    cache_key = None
+    if response_cache.should_cache(None, cache):
+        cache_key = response_cache.make_key("gemini", {"model": GEMINI_MODEL, "prompt": request.prompt})
+        cached = await response_cache.cache.get(cache_key)
+        if cached is not None:
+            http_response.headers["X-Cache"] = "HIT"
+            return cached
+    http_response.headers["X-Cache"] = "MISS" if cache_key else "BYPASS"
+
     try:
-        model = genai.GenerativeModel(GEMINI_MODEL)
+        model = model_registry.get_model(GEMINI_MODEL)
         
-        # Gera o conteúdo usando o modelo
-        response = model.generate_content(request.prompt)
+        def generate():
+            response = model.generate_content(request.prompt, request_options=GEMINI_REQUEST_OPTIONS)
+            record_gemini_usage(response)
+            return gemini_payload(response)
+
+        # Gera o conteúdo usando o modelo (o SDK é bloqueante: a chamada roda no threadpool);
+        # no modo de gravação/replay (LLM_PROVIDER_MODE) a resposta vem do cassete
+        response = await cassette.through(
+            cassette.make_key("gemini", "chat", {"model": GEMINI_MODEL, "prompt": request.prompt}), "gemini",
+            lambda: resilience.gemini.call_in_thread(generate, resilience.estimate_tokens(request.prompt)),
+        )
         
         # Verifica se a resposta contém texto
-        if response.parts:
+        if response["parts"]:
             # Concatena todas as partes da resposta
-            full_response_text = "".join([part.text for part in response.parts if hasattr(part, 'text')])
+            full_response_text = "".join(response["parts"])
+            if cache_key:
+                await response_cache.cache.set(cache_key, {"response": full_response_text})
             return {"response": full_response_text}
         else:
             # Lida com casos onde a resposta pode ser vazia ou não ter texto
             return {"response": "Não foi possível gerar uma resposta para o prompt."}
 
+    except HTTPException:
+        raise
     except Exception as e:
         # Captura erros da API ou outros problemas
         raise HTTPException(
@@ -260,127 +521,564 @@ async def chat_with_gemini(request: PromptRequest):
             detail=f"Erro ao interagir com o modelo Gemini: {str(e)}"
         )
 
+@app.post("/chat/gemini/stream",tags=["Interação com LLM"])
+async def chat_with_gemini_stream(request: PromptRequest):
+    """
+    Como /chat/gemini, mas a resposta é enviada em server-sent events à medida que o Gemini gera o texto:
+    um evento `data: {"text": "..."}` por trecho e `data: [DONE]` no final.
+    """
+    model = model_registry.get_model(GEMINI_MODEL)
+
+    async def open_live():
+        # A chamada e a iteração do SDK são bloqueantes: rodam no threadpool, fora do event loop
+        response = await resilience.gemini.call_in_thread(
+            lambda: model.generate_content(request.prompt, stream=True, request_options=GEMINI_REQUEST_OPTIONS),
+            resilience.estimate_tokens(request.prompt),
+        )
+
+        async def texts():
+            chunk = None
+            async for chunk in iterate_in_threadpool(iter(response)):
+                text = "".join([part.text for part in chunk.parts if hasattr(part, 'text')])
+                if text:
+                    yield text
+            # o último trecho traz o total de tokens da resposta
+            record_gemini_usage(chunk)
+
+        return texts()
+
+    try:
+        texts = await cassette.open_stream(
+            cassette.make_key("gemini", "chat", {"model": GEMINI_MODEL, "prompt": request.prompt, "stream": True}),
+            "gemini", open_live,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, 
+            detail=f"Erro ao interagir com o modelo Gemini: {str(e)}"
+        )
+
+    async def events():
+        try:
+            async for text in texts:
+                yield sse_event({"text": text})
+            yield sse_event("[DONE]")
+        except Exception as e:
+            yield sse_event({"erro": f"Erro ao interagir com o modelo Gemini: {str(e)}"}, event="error")
+        finally:
+            await texts.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 # --- Endpoint da API ---
 
 @app.post("/invoices/extract/save" ,tags=["Interação com LLM"] ) # , response_model=InvoiceResponse
-async def extract_invoice_data_with_gemini_and_save(file: UploadFile = File(...), session = Depends(get_session)):
+async def extract_invoice_data_with_gemini_and_save(file: UploadFile = File(...), session: AsyncSession = Depends(get_async_session)):
     """
     Recebe uma imagem de nota fiscal, extrai CNPJ, data e valor total e grava na base de notas.
+    PDFs e TIFFs com várias páginas são extraídos página a página (ver /invoices/extract/document).
     """
     return await extract_invoice_data(file,True,session)
 
 @app.post("/invoices/extract/check" ,tags=["Interação com LLM"] ) # , response_model=InvoiceResponse
-async def extract_invoice_data_with_gemini_for_checking(file: UploadFile = File(...), session = Depends(get_session)):
+async def extract_invoice_data_with_gemini_for_checking(file: UploadFile = File(...), session: AsyncSession = Depends(get_async_session)):
     """
     Recebe uma imagem de nota fiscal, extrai CNPJ, data e valor total. Não grava em base de dados.
+    PDFs e TIFFs com várias páginas são extraídos página a página (ver /invoices/extract/document).
     """
     return await extract_invoice_data(file,False,session)
 
-async def extract_invoice_data(file: UploadFile, save: bool, session):
+@app.post("/invoices/extract/document" ,tags=["Interação com LLM"] )
+async def extract_invoice_document(
+    file: UploadFile = File(...),
+    save: bool = Form(False),
+    session: AsyncSession = Depends(get_async_session),
+):
     """
-    Recebe uma imagem de nota fiscal, extrai CNPJ, data e valor total.
+    Recebe uma nota fiscal em PDF ou TIFF com várias páginas. As páginas são rasterizadas sob demanda e
+    extraídas em paralelo (até DOCUMENT_PAGE_WINDOW por vez); com `save=true` a nota é gravada na base.
+
+    A resposta é NDJSON: uma linha por página, emitida assim que a página termina
+    (`{"pagina": 2, "status_code": 200, "campos": {...}}`), e uma linha final com os campos de
+    cabeçalho das páginas juntos (`{"documento": {...}, "status_code": 200, "invoice": {...}}`).
     """
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="O arquivo enviado não é uma imagem.")
+    kind = documents.document_kind(file.content_type, file.filename)
+    if kind is None:
+        raise HTTPException(status_code=400, detail="O arquivo enviado não é um PDF ou TIFF.")
+
+    path, hash, pages, encontrou = await open_document(file, kind, save, session)
+    # o arquivo temporário também é removido se o cliente desconectar antes de o stream começar
+    # (document_events não chega a rodar); a tarefa roda depois do envio, com ou sem desconexão
+    cleanup = BackgroundTask(documents.discard, path) if path else None
+
+    async def lines():
+        events = document_events(path, kind, pages, hash, save) if encontrou is None else \
+            _single_event({"documento": {"duplicada": True}, "status_code": 200, "invoice": encontrou})
+        async for event in events:
+            if "invoice" in event:
+                event["invoice"] = jsonable_encoder(InvoiceResponse.model_validate(event["invoice"], from_attributes=True))
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", background=cleanup)
+
+async def _single_event(event: dict):
+    yield event
+
+@app.post("/invoices/extract/hedged" ,tags=["Interação com LLM"] ) # , response_model=InvoiceResponse
+async def extract_invoice_data_hedged(
+    file: UploadFile = File(...),
+    save: bool = Form(False),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Como /invoices/extract/check (ou /save com `save=true`), mas com dois provedores: começa pelo
+    HEDGE_PRIMARY (Gemini Vision) e, se ele não responder dentro do p95 da sua latência recente,
+    dispara também o Tesseract+Mistral. Vale o primeiro resultado válido; a outra chamada é cancelada.
+    """
+    image_data = await read_upload(file)
+    return await extract_invoice_from_bytes(image_data, file.content_type, save, session, hedged=True)
+
+@app.post("/invoices/extract/batch" ,tags=["Interação com LLM"] )
+async def extract_invoice_data_with_gemini_batch(
+    files: list[UploadFile] = File(...),
+    save: bool = Form(False),
+    concurrency: int | None = Form(None),
+):
+    """
+    Recebe várias imagens de notas fiscais (ou arquivos ZIP com imagens) e extrai CNPJ, data e valor total
+    de todas em paralelo, limitado a `concurrency` extrações simultâneas (padrão EXTRACT_BATCH_CONCURRENCY).
+    Com `save=true` grava cada nota na base, como em /invoices/extract/save.
 
-    try:
-        # Carrega a imagem para o formato que o Gemini espera
-        image_data = await file.read()
-        image_parts = [
-            {
-                "mime_type": file.content_type,
-                "data": image_data
-            }
-        ]
-
-        # Prepara o modelo Gemini Vision
-        model_vision = genai.GenerativeModel(GEMINI_PRO_VISION_MODEL)
-
-        # Prompt de engenharia para extração de dados em JSON
-        # É crucial pedir o formato JSON e instruir para usar 'null' se o dado não for encontrado.
-
-        itemObject = session.query(Configurations).first()
-
-        prompt = ""
-        if itemObject and itemObject.prompt:
-            logger.warning("usando config...")
-            prompt = itemObject.prompt
-        else:
-            prompt = "Analise esta imagem de nota fiscal. Extraia as seguintes informações e formate-as como um objeto JSON. Se um dado não for encontrado, use `null`. Não adicione nenhum texto antes ou depois do JSON. Certifique-se de que o JSON é válido: {\"cnpj\":[CNPJ ou NPJ ou IPJ ou PJ ou P depois do :, com 14 números ou mais], \"data\":[Data da emissão no formato DD/MM/AAAA], \"valor\":[Valor total pago da nota fiscal, em formato numérico com ponto como separador decimal, ex: 123.45]} "
-            logger.warning("usando default...")
-           
-        prompt_parts =  [prompt, "Imagem:", image_parts[0] ]
- 
-        # Gera o conteúdo
-        response = model_vision.generate_content(prompt_parts)
-        
-        # O Gemini pode retornar texto em partes. Juntamos tudo.
-        raw_llm_response = "".join([part.text for part in response.parts if hasattr(part, 'text')])
+    A resposta é NDJSON: uma linha por arquivo, emitida assim que a extração daquele arquivo termina.
+    """
+    limit = concurrency or EXTRACT_BATCH_CONCURRENCY
+    limit = max(1, min(limit, EXTRACT_BATCH_MAX_CONCURRENCY))
+
+    if len(files) > EXTRACT_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"O lote excede o limite de {EXTRACT_BATCH_MAX_FILES} imagens."
+        )
 
-        # Tenta extrair o JSON da resposta do LLM
-        json_data = {}
+    # Lê todos os uploads ainda dentro da requisição; o streaming da resposta roda depois.
+    # Cada item é (nome, content type, bytes ou entrada do ZIP, erro); arquivos com erro viram uma linha de erro.
+    # As entradas dos ZIPs só são contadas e somadas aqui (pelo índice do arquivo): a descompactação
+    # fica para a extração de cada uma, então a memória acompanha a concorrência e não o lote.
+    items = []
+    archives = []
+    total_bytes = 0
+    for upload in files:
+        is_zip = _is_zip(upload.filename, upload.content_type)
         try:
-            # Tenta encontrar o bloco JSON na resposta
-            start_index = raw_llm_response.find("```json")
-            end_index = raw_llm_response.find("```", start_index + 1)
-            
-            if start_index != -1 and end_index != -1:
-                json_string = raw_llm_response[start_index + len("```json"):end_index].strip()
-                json_data = json.loads(json_string)
-            else:
-                # Se não encontrar o bloco ```json```, tenta parsear a resposta completa
-                json_data = json.loads(raw_llm_response.strip())
-
-        except json.JSONDecodeError as e:
-            print(f"Não foi possível parsear o JSON da resposta do LLM: {raw_llm_response}. Erro: {e}")
+            data = await read_upload(upload, MAX_ZIP_UPLOAD_BYTES if is_zip else MAX_UPLOAD_BYTES)
+        except HTTPException as e:
+            items.append((upload.filename, upload.content_type, None, e))
+            continue
+        if is_zip:
+            try:
+                archive = zipfile.ZipFile(io.BytesIO(data))
+            except zipfile.BadZipFile:
+                items.append((upload.filename, upload.content_type, None,
+                              HTTPException(status_code=400, detail="Arquivo ZIP inválido.")))
+                continue
+            archives.append(archive)
+            entries = _images_from_zip(archive)
+            items.extend(entries)
+            total_bytes += sum(entry[2][1].file_size for entry in entries if entry[2] is not None)
+        else:
+            items.append((upload.filename, upload.content_type, data, None))
+            total_bytes += len(data)
+
+        if len(items) > EXTRACT_BATCH_MAX_FILES or total_bytes > EXTRACT_BATCH_MAX_BYTES:
+            for archive in archives:
+                archive.close()
+            if len(items) > EXTRACT_BATCH_MAX_FILES:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"O lote excede o limite de {EXTRACT_BATCH_MAX_FILES} imagens."
+                )
             raise HTTPException(
-                status_code=500,
-                detail=f"Erro ao parsear a resposta do modelo. Resposta recebida: {raw_llm_response.strip()}"
+                status_code=413,
+                detail=f"O lote excede o limite de {EXTRACT_BATCH_MAX_BYTES} bytes descompactados."
             )
 
-        # Converte o valor para float se não for nulo
-        if 'valor' in json_data and json_data['valor'] is not None:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def process(filename, content_type, data, error):
+        if error is not None:
+            return filename, error.status_code, error.detail
+        async with semaphore, AsyncSessionLocal() as session:
             try:
-                json_data['valor'] = float(json_data['valor'])
-            except ValueError:
-                json_data['valor'] = None # Ou manter como string se a conversão falhar
-        
-        # gera hash imagem
-        hash = gerar_hash_imagem(image_data)
- 
- 
-        # persistência
-        
-        #logger.warning("Verificando Hash existe: "+hash)
-        encontrou = session.query(Invoice).filter_by(imagem_hash=hash).all()
-        #logger.warning(encontrou)
+                if isinstance(data, tuple):
+                    # entrada de ZIP: descompactada só agora, com a vaga do semáforo
+                    archive, info = data
+                    try:
+                        data = await run_in_threadpool(archive.read, info)
+                    except (zipfile.BadZipFile, zlib.error):
+                        return filename, 400, "Arquivo ZIP inválido."
+                invoice = await extract_invoice_from_bytes(data, content_type, save, session)
+                return filename, 200, InvoiceResponse.model_validate(invoice, from_attributes=True)
+            except HTTPException as e:
+                return filename, e.status_code, e.detail
+
+    async def results():
+        tasks = [asyncio.create_task(process(*item)) for item in items]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                filename, status_code, result = await next_done
+                line = {"arquivo": filename, "status_code": status_code}
+                if status_code == 200:
+                    line["invoice"] = jsonable_encoder(result)
+                else:
+                    line["erro"] = result
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        finally:
+            # cliente desconectou: não deixa extrações órfãs rodando
+            for task in tasks:
+                task.cancel()
+            for archive in archives:
+                archive.close()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+def _is_zip(filename: str | None, content_type: str | None) -> bool:
+    return (content_type or "") in ("application/zip", "application/x-zip-compressed") \
+        or (filename or "").lower().endswith(".zip")
+
+def _images_from_zip(archive: zipfile.ZipFile):
+    """
+    Retorna (nome, content type, (archive, info), erro) para cada imagem contida no ZIP, ignorando diretórios
+    e outros arquivos. Nada é descompactado aqui: o tamanho de cada imagem vem do índice do ZIP.
+    """
+    images = []
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        content_type, _ = mimetypes.guess_type(info.filename)
+        if not content_type or not content_type.startswith("image/"):
+            continue
+        if info.file_size > MAX_UPLOAD_BYTES:
+            images.append((info.filename, content_type, None, HTTPException(
+                status_code=413, detail=f"O arquivo excede o limite de {MAX_UPLOAD_BYTES} bytes.")))
+            continue
+        images.append((info.filename, content_type, (archive, info), None))
+    return images
+
+DEFAULT_EXTRACTION_PROMPT = "Analise esta imagem de nota fiscal. Extraia as seguintes informações e formate-as como um objeto JSON. Se um dado não for encontrado, use `null`. Não adicione nenhum texto antes ou depois do JSON. Certifique-se de que o JSON é válido: {\"cnpj\":[CNPJ ou NPJ ou IPJ ou PJ ou P depois do :, com 14 números ou mais], \"data\":[Data da emissão no formato DD/MM/AAAA], \"valor\":[Valor total pago da nota fiscal, em formato numérico com ponto como separador decimal, ex: 123.45]} "
+
+def get_extraction_prompt(session) -> str:
+    """
+    Retorna o prompt de extração configurado em /configuration ou o prompt padrão.
+    """
+    # É crucial pedir o formato JSON e instruir para usar 'null' se o dado não for encontrado.
+    prompt = config_cache.cache.get_prompt(session)
 
-        status="CHECKING"
+    if prompt:
+        logger.warning("usando config...")
+        return prompt
+
+    logger.warning("usando default...")
+    return DEFAULT_EXTRACTION_PROMPT
+
+def prepare_gemini_extraction(image_data: bytes, content_type: str, prompt: str):
+    """
+    Pré-processa a imagem e retorna o conteúdo da extração e a função `request(contents, kind, image)`,
+    que monta a chave do cassete e a chamada bloqueante ao Gemini Vision para esse conteúdo.
+    """
+    # Reduz a imagem (resolução, cor, EXIF) antes do envio: menos bytes e menos tokens de visão
+    with STAGE_SECONDS.time(stage="preprocess"):
+        preprocessed = preprocess_image(image_data, content_type)
+
+    # Carrega a imagem para o formato que o Gemini espera
+    image_parts = [
+        {
+            "mime_type": preprocessed.content_type,
+            "data": preprocessed.data
+        }
+    ]
+
+    # Prepara o modelo Gemini Vision (instância reutilizada entre requisições).
+    # No modo JSON a resposta segue o esquema de llm_json.INVOICE_SCHEMA.
+    if llm_json.LLM_JSON_MODE:
+        model_vision = model_registry.get_model(GEMINI_PRO_VISION_MODEL, generation_config=llm_json.GEMINI_GENERATION_CONFIG)
+    else:
+        model_vision = model_registry.get_model(GEMINI_PRO_VISION_MODEL)
+
+    prompt_parts =  [prompt, "Imagem:", image_parts[0] ]
+
+    def request(contents, kind: str, image: bytes | None):
+        def call():
+            response = model_vision.generate_content(contents, request_options=GEMINI_REQUEST_OPTIONS)
+            record_gemini_usage(response)
+            return gemini_payload(response)
+
+        # no modo de gravação/replay (LLM_PROVIDER_MODE) a resposta vem do cassete
+        key = cassette.make_key(
+            "gemini", kind, {"model": GEMINI_PRO_VISION_MODEL, "prompt": contents[0] if image else contents,
+                             "json_mode": llm_json.LLM_JSON_MODE}, image)
+        return key, call
+
+    return prompt_parts, request
+
+def extract_fields_with_gemini(image_data: bytes, content_type: str, prompt: str) -> dict:
+    """
+    Envia a imagem ao Gemini Vision e retorna o JSON extraído (cnpj, data, valor).
+    Chamada bloqueante, para o worker da fila; nas rotas use extract_fields_with_gemini_async.
+    """
+    started = time.perf_counter()
+    prompt_parts, request = prepare_gemini_extraction(image_data, content_type, prompt)
+
+    def generate(contents, kind: str, image: bytes | None, tokens: int) -> dict:
+        key, call = request(contents, kind, image)
+        # com limite de taxa, novas tentativas em 429/5xx e circuit breaker
+        with STAGE_SECONDS.time(stage="llm_gemini"):
+            return cassette.through_sync(key, "gemini", lambda: resilience.gemini.call_sync(call, tokens))
+
+    # Gera o conteúdo
+    response = generate(prompt_parts, "extract", image_data, resilience.estimate_tokens(prompt, images=1))
+    
+    # O Gemini pode retornar texto em partes. Juntamos tudo.
+    raw_llm_response = "".join(response["parts"])
 
+    def reask(prompt: str) -> str:
+        return "".join(generate(prompt, "reask", None, resilience.estimate_tokens(prompt))["parts"])
+
+    # JSON da resposta (cnpj, data, valor); se não for JSON válido, pede a correção uma vez
+    json_data = llm_json.parse_with_reask(raw_llm_response, reask)
+    hedging.record_latency("gemini", time.perf_counter() - started)
+    return json_data
+
+async def extract_fields_with_gemini_async(image_data: bytes, content_type: str, prompt: str) -> dict:
+    """
+    Como extract_fields_with_gemini, para as rotas: o pré-processamento e cada chamada ao SDK rodam no
+    threadpool, e as esperas do limitador de taxa e entre tentativas ficam no event loop.
+    """
+    started = time.perf_counter()
+    prompt_parts, request = await run_in_threadpool(prepare_gemini_extraction, image_data, content_type, prompt)
+
+    async def generate(contents, kind: str, image: bytes | None, tokens: int) -> dict:
+        key, call = request(contents, kind, image)
+        with STAGE_SECONDS.time(stage="llm_gemini"):
+            return await cassette.through(key, "gemini", lambda: resilience.gemini.call_in_thread(call, tokens))
+
+    response = await generate(prompt_parts, "extract", image_data, resilience.estimate_tokens(prompt, images=1))
+    raw_llm_response = "".join(response["parts"])
+
+    async def reask(prompt: str) -> str:
+        return "".join((await generate(prompt, "reask", None, resilience.estimate_tokens(prompt)))["parts"])
+
+    json_data = await llm_json.parse_with_reask_async(raw_llm_response, reask)
+    hedging.record_latency("gemini", time.perf_counter() - started)
+    return json_data
+
+async def extract_invoice_data(file: UploadFile, save: bool, session: AsyncSession):
+    """
+    Recebe uma imagem de nota fiscal, extrai CNPJ, data e valor total.
+    """
+    kind = documents.document_kind(file.content_type, file.filename)
+    if kind is not None:
+        return await extract_document_invoice(file, kind, save, session)
+    image_data = await read_upload(file)
+    return await extract_invoice_from_bytes(image_data, file.content_type, save, session)
+
+async def open_document(file: UploadFile, kind: str, save: bool, session: AsyncSession):
+    """
+    Copia o PDF/TIFF para um arquivo temporário, procura nota já cadastrada com o mesmo hash e conta as páginas.
+    Retorna (caminho, hash, páginas, nota já cadastrada); com nota já cadastrada o arquivo é removido.
+    """
+    path, hash = await documents.spool_upload(file, kind)
+    try:
+        encontrou = await session.scalar(select(Invoice).filter_by(imagem_hash=hash).limit(1))
         if encontrou:
-            status=encontrou[0].status
-        else:
+            LLM_CALLS_AVOIDED.inc()
             if save:
-                status="PEDENTE"
+                raise HTTPException(status_code=400, detail="O arquivo enviado já está cadastrado.")
+            documents.discard(path)
+            return None, hash, 0, encontrou
+        pages = await documents.page_count(path, kind)
+    except BaseException:
+        documents.discard(path)
+        raise
+    return path, hash, pages, None
+
+async def document_events(path: str, kind: str, pages: int, hash: str, save: bool):
+    """
+    Extrai as páginas do documento com o Gemini (ver documents.extract_pages), produzindo o resultado de
+    cada página, e no fim junta os campos de cabeçalho e grava a nota se `save`. Remove o arquivo temporário.
+    """
+    results = []
+    try:
+        async with AsyncSessionLocal() as session:
+            prompt = await session.run_sync(get_extraction_prompt)
+
+        def extract(image: bytes):
+            return extract_fields_with_gemini_async(image, documents.PAGE_CONTENT_TYPE, prompt)
 
-        if save and encontrou:
+        async for result in documents.extract_pages(path, kind, pages, extract):
+            results.append(result)
+            yield result
+    finally:
+        documents.discard(path)
+
+    summary = {"paginas": pages, "paginas_com_erro": sum(1 for r in results if "campos" not in r)}
+    if summary["paginas_com_erro"] == pages:
+        yield {"documento": summary, "status_code": 500, "erro": "Nenhuma página do documento pôde ser extraída."}
+        return
+
+    json_data = documents.merge_pages(results)
+    invoiceNew = Invoice(
+        cnpj=json_data.get('cnpj'),
+        data_emissao=json_data.get('data'),
+        valor_total=json_data.get('valor'),
+        imagem_hash=hash,
+        status="PEDENTE" if save else "CHECKING"
+    )
+    if save:
+        async with AsyncSessionLocal() as session:
+            session.add(invoiceNew)
+            try:
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                yield {"documento": summary, "status_code": 400, "erro": "O arquivo enviado já está cadastrado."}
+                return
+            await session.refresh(invoiceNew)
+    yield {"documento": summary, "status_code": 200, "invoice": invoiceNew}
+
+async def extract_document_invoice(file: UploadFile, kind: str, save: bool, session: AsyncSession):
+    """
+    Extrai uma nota em PDF/TIFF e retorna só o resultado final, como as rotas de imagem.
+    """
+    path, hash, pages, encontrou = await open_document(file, kind, save, session)
+    if encontrou:
+        return encontrou
+    events = document_events(path, kind, pages, hash, save)
+    try:
+        async for event in events:
+            if "documento" in event:
+                if event["status_code"] != 200:
+                    raise HTTPException(status_code=event["status_code"], detail=event["erro"])
+                return event["invoice"]
+    finally:
+        # fecha o gerador já (cancela páginas pendentes) e garante a remoção do arquivo
+        await events.aclose()
+        documents.discard(path)
+
+async def find_near_duplicate(session: AsyncSession, image_data: bytes):
+    """
+    Calcula o hash perceptual da imagem e procura uma nota cadastrada quase igual.
+
+    Retorna (phash, nota). A nota só é retornada quando PHASH_SKIP_NEAR_DUPLICATES está ativo;
+    caso contrário a semelhança é apenas registrada no log.
+    """
+    try:
+        phash = await run_in_threadpool(gerar_dhash_imagem, image_data)
+    except image_preprocess.UNREADABLE_IMAGE_ERRORS:
+        return None, None
+
+    match = await session.run_sync(phash_index.index.find, phash)
+    if match is None:
+        return phash, None
+
+    invoice, distance = match
+    NEAR_DUPLICATES_FOUND.inc()
+    logger.info("Imagem semelhante à nota %s (distância %s).", invoice.id, distance)
+    if not phash_index.PHASH_SKIP_NEAR_DUPLICATES:
+        return phash, None
+    return phash, invoice
+
+async def extract_invoice_from_bytes(image_data: bytes, content_type: str, save: bool, session: AsyncSession,
+                                     hedged: bool = False):
+    """
+    Extrai CNPJ, data e valor total dos bytes de uma imagem de nota fiscal.
+    Com `hedged` o Gemini e o Tesseract+Mistral concorrem (ver hedging.run_hedged).
+    """
+    EXTRACTIONS_IN_FLIGHT.inc()
+    try:
+        with STAGE_SECONDS.time(stage="total"):
+            return await _extract_invoice_from_bytes(image_data, content_type, save, session, hedged)
+    finally:
+        EXTRACTIONS_IN_FLIGHT.dec()
+
+async def _extract_invoice_from_bytes(image_data: bytes, content_type: str, save: bool, session: AsyncSession,
+                                      hedged: bool):
+    if not content_type or not content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="O arquivo enviado não é uma imagem.")
+
+    # gera hash imagem antes de chamar o modelo: reenvios da mesma nota
+    # são resolvidos pela base, sem custo de LLM
+    with STAGE_SECONDS.time(stage="hash"):
+        hash = gerar_hash_imagem(image_data)
+    with STAGE_SECONDS.time(stage="dedup_query"):
+        encontrou = await session.scalar(select(Invoice).filter_by(imagem_hash=hash).limit(1))
+
+    # sem cópia exata: procura uma nota visualmente igual (foto recomprimida ou redimensionada)
+    phash = None
+    if not encontrou:
+        with STAGE_SECONDS.time(stage="near_duplicate"):
+            phash, encontrou = await find_near_duplicate(session, image_data)
+
+    if encontrou:
+        LLM_CALLS_AVOIDED.inc()
+        logger.info("Nota já cadastrada (id %s), chamada ao LLM evitada.", encontrou.id)
+        if save:
             raise HTTPException(status_code=400, detail="O arquivo enviado já está cadastrado.")
+        return encontrou
+
+    try:
+        with STAGE_SECONDS.time(stage="config_lookup"):
+            prompt = await session.run_sync(get_extraction_prompt)
+
+        if hedged:
+            provider, json_data = await hedging.run_hedged({
+                "gemini": lambda: extract_fields_with_gemini_async(image_data, content_type, prompt),
+                "mistral": lambda: extract_fields_with_mistral(image_data),
+            })
+            logger.info("Extração hedged respondida por %s.", provider)
+        else:
+            # O SDK é bloqueante: as chamadas ao modelo rodam no threadpool
+            try:
+                json_data = await extract_fields_with_gemini_async(image_data, content_type, prompt)
+            except resilience.CircuitOpenError:
+                # Gemini fora do ar: usa o Tesseract+Mistral enquanto o circuito estiver aberto
+                if not resilience.LLM_FALLBACK:
+                    raise
+                logger.warning("Circuito do Gemini aberto; extração feita pelo Mistral.")
+                json_data = await extract_fields_with_mistral(image_data)
+
+        # persistência
+        status="CHECKING"
+        if save:
+            status="PEDENTE"
 
         invoiceNew = Invoice(
             cnpj=json_data.get('cnpj'), 
             data_emissao=json_data.get('data'), 
             valor_total=json_data.get('valor'),
             imagem_hash=hash,
+            imagem_phash=phash,
             status=status
         )
 
         if save:
             session.add(invoiceNew)
-            session.commit()
-            session.refresh(invoiceNew)
+            try:
+                with STAGE_SECONDS.time(stage="db_commit"):
+                    await session.commit()
+            except IntegrityError:
+                # outra requisição gravou a mesma imagem enquanto o modelo respondia
+                await session.rollback()
+                raise HTTPException(status_code=400, detail="O arquivo enviado já está cadastrado.")
+            await session.refresh(invoiceNew)
+            if phash:
+                phash_index.index.add(invoiceNew.id, phash)
 
         return invoiceNew
-    
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, 
@@ -388,25 +1086,146 @@ async def extract_invoice_data(file: UploadFile, save: bool, session):
         )
 
  
+@app.post("/invoices/jobs",tags=["Fila de extração"], status_code=202, response_model=JobResponse)
+async def submit_extraction_job(file: UploadFile = File(...), session: AsyncSession = Depends(get_async_session)):
+    """
+    Grava a imagem na fila de extração e retorna imediatamente. A extração é feita pelos workers
+    (python -m app.worker); consulte o andamento em GET /invoices/jobs/{id}.
+    """
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="O arquivo enviado não é uma imagem.")
+
+    image_data = await read_upload(file)
+    hash = gerar_hash_imagem(image_data)
+    encontrou = await session.scalar(select(Invoice).filter_by(imagem_hash=hash).limit(1))
+
+    phash = None
+    if not encontrou:
+        phash, encontrou = await find_near_duplicate(session, image_data)
+
+    if encontrou:
+        LLM_CALLS_AVOIDED.inc()
+        raise HTTPException(status_code=400, detail="O arquivo enviado já está cadastrado.")
+
+    try:
+        job = await session.run_sync(job_queue.enqueue, image_data, file.filename, file.content_type, hash, phash)
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(status_code=400, detail="O arquivo enviado já está cadastrado.")
+
+    if phash:
+        phash_index.index.add(job.invoice_id, phash)
+
+    return await session.run_sync(_job_response, job)
+
+@app.get("/invoices/jobs/{id}",tags=["Fila de extração"], response_model=JobResponse)
+def get_extraction_job(id:int, session = Depends(get_session)):
+    """
+    Retorna o andamento de um job de extração e a nota associada.
+    """
+    job = session.get(ExtractionJob, id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    return _job_response(session, job)
+
+@app.post("/invoices/jobs/{id}/retry",tags=["Fila de extração"], response_model=JobResponse)
+def retry_extraction_job(id:int, session = Depends(get_session)):
+    """
+    Devolve para a fila um job que esgotou as tentativas (status DEAD).
+    """
+    job = session.get(ExtractionJob, id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado.")
+    if job.status != "DEAD":
+        raise HTTPException(status_code=400, detail="Somente jobs com status DEAD podem ser reprocessados.")
+    job_queue.requeue(session, job)
+    return _job_response(session, job)
+
+def _job_response(session, job: ExtractionJob) -> JobResponse:
+    invoice = session.get(Invoice, job.invoice_id) if job.invoice_id else None
+    return JobResponse(
+        job_id=job.id,
+        invoice_id=job.invoice_id,
+        status=job.status,
+        attempts=job.attempts or 0,
+        max_attempts=job.max_attempts or 0,
+        last_error=job.last_error,
+        invoice=InvoiceResponse.model_validate(invoice, from_attributes=True) if invoice else None,
+    )
+
 @app.get("/invoices",tags=["Crud"], response_model=list[InvoiceResponse])
-def get_invoices(session: Session = Depends(get_session)):
+async def get_invoices(
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=1000, description="Notas por página; sem limit e sem cursor vêm todas as notas"),
+    cursor: str | None = None,
+    status: str | None = None,
+    cnpj: str | None = None,
+    data_inicio: date | None = None,
+    data_fim: date | None = None,
+    sort: str = Query("id", description="id, data_emissao ou valor_total; prefixo - para ordem decrescente"),
+    include_total: bool = False,
+    session: AsyncSession = Depends(get_async_session),
+):
     """
-    Retorna lista de documentos extraidos.
+    Retorna lista de documentos extraidos, paginada por cursor.
+
+    Sem `limit` e sem `cursor` a lista vem inteira, como antes da paginação (usado pelo dashboard).
+    Com `limit` (ou só `cursor`, com páginas de 100), a próxima página é obtida repassando o header
+    `X-Next-Cursor` no parâmetro `cursor` (ausente na última página). Com `include_total=true` o
+    total de notas que atendem aos filtros vem no header `X-Total-Count`.
     """
-    items = session.query(Invoice).all()
+    if limit is None and cursor is not None:
+        limit = invoice_query.DEFAULT_LIMIT
+    statement = invoice_query.apply_filters(select(Invoice), status, cnpj, data_inicio, data_fim)
+
+    if include_total:
+        total = await session.scalar(select(func.count()).select_from(statement.subquery()))
+        response.headers["X-Total-Count"] = str(total)
+
+    rows = (await session.execute(invoice_query.page_statement(statement, sort, cursor, limit))).all()
+    items, next_cursor = invoice_query.split_page(rows, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
 
     return items
 
+@app.get("/invoices/export",tags=["Crud"])
+async def export_invoices(
+    format: str = Query("csv", description="csv, ndjson ou parquet"),
+    compress: str | None = Query(None, description="gzip para comprimir durante o envio"),
+    status: str | None = None,
+    cnpj: str | None = None,
+    data_inicio: date | None = None,
+    data_fim: date | None = None,
+):
+    """
+    Exporta as notas que atendem aos filtros da listagem em CSV, NDJSON ou Parquet (este precisa do
+    pacote pyarrow). As linhas são lidas do banco em blocos de EXPORT_CHUNK_ROWS e enviadas conforme
+    são lidas, sem carregar todas as notas em memória. Notas cujo valor_total não foi reconhecido como
+    número saem com o texto gravado no CSV/NDJSON e com valor nulo no Parquet.
+    """
+    invoice_export.check_format(format, compress)
+    statement = invoice_query.apply_filters(select(Invoice), status, cnpj, data_inicio, data_fim)
+
+    async def body():
+        # sessão própria: a da dependência é fechada antes de a resposta terminar de ser enviada
+        async with AsyncSessionLocal() as session:
+            async for chunk in invoice_export.export_rows(session, statement, format, compress):
+                yield chunk
+
+    headers = {"Content-Disposition": f'attachment; filename="{invoice_export.filename(format, compress)}"'}
+    return StreamingResponse(body(), media_type=invoice_export.media_type(format, compress), headers=headers)
+
 @app.get("/invoices/{id}",tags=["Crud"])
-def get_invoice(id:int, session: Session = Depends(get_session)):
+async def get_invoice(id:int, session: AsyncSession = Depends(get_async_session)):
     """
     Retorna um documento a parti do id.
     """
-    item = session.query(Invoice).get(id)
+    item = await session.get(Invoice, id)
     return item
 
 @app.post("/invoices/add",tags=["Crud"])
-def create_invoice(invoice:InvoiceRequest, session = Depends(get_session)):
+async def create_invoice(invoice:InvoiceRequest, session: AsyncSession = Depends(get_async_session)):
     """
     Adiciona um novo documento.
     """
@@ -421,32 +1240,32 @@ def create_invoice(invoice:InvoiceRequest, session = Depends(get_session)):
         status= "PROCESSADO"
     )
     session.add(itemObject)
-    session.commit()
-    session.refresh(itemObject)
+    await session.commit()
+    await session.refresh(itemObject)
     return itemObject
 
 @app.put("/invoices/{id}",tags=["Crud"])
-def update_invoice(id:int, invoice:InvoiceRequest, session = Depends(get_session)):
+async def update_invoice(id:int, invoice:InvoiceRequest, session: AsyncSession = Depends(get_async_session)):
     """
     Atualiza um documento parcialmente.
     """
-    itemObject = session.query(Invoice).get(id)
+    itemObject = await session.get(Invoice, id)
     itemObject.cnpj = invoice.cnpj 
     itemObject.data_emissao = invoice.data_emissao 
     itemObject.valor_total = invoice.valor_total 
     itemObject.status = invoice.status 
-    session.commit()
+    await session.commit()
     return itemObject
 
 @app.delete("/invoices/{id}",tags=["Crud"])
-def delete_invoice(id:int, session = Depends(get_session)):
+async def delete_invoice(id:int, session: AsyncSession = Depends(get_async_session)):
     """
     Exclue um documento a partir do ID.
     """
-    itemObject = session.query(Invoice).get(id)
-    session.delete(itemObject)
-    session.commit()
-    session.close()
+    itemObject = await session.get(Invoice, id)
+    await session.delete(itemObject)
+    await session.commit()
+    await session.close()
     return 'Documento removido permanentemente.'
 
 
@@ -459,15 +1278,19 @@ def update_configuration(config:ConfigurationRequest, session = Depends(get_sess
 
     if configUpdated:
         configUpdated.prompt = config.prompt 
+        configUpdated.version = (configUpdated.version or 0) + 1
         logger.warning("Encontrou:"+configUpdated.prompt)
     else:   
-        configUpdated = Configurations(prompt=config.prompt)
+        configUpdated = Configurations(prompt=config.prompt, version=1)
         logger.warning("Novo:"+configUpdated.prompt)
 
     session.add(configUpdated)
     session.commit()
     session.refresh(configUpdated)
 
+    # os demais processos percebem a nova versão quando o cache deles expira
+    config_cache.cache.set(configUpdated.prompt, configUpdated.version)
+
     return configUpdated
 
 @app.get("/configuration",tags=["Configuração"])
@@ -481,3 +1304,29 @@ def get_configuration(session = Depends(get_session)):
 
     return config
 
+@app.get("/stats",tags=["Monitoramento"])
+def get_stats():
+    """
+    Retorna os contadores internos da API (ex.: chamadas ao LLM evitadas por deduplicação).
+    """
+    return metrics.snapshot()
+
+@app.get("/health/providers",tags=["Monitoramento"])
+def get_providers_health():
+    """
+    Estado de cada provedor de LLM: circuito (closed, open, half_open), falhas seguidas e
+    capacidade restante nos limites por minuto (requisições e tokens) deste processo.
+    """
+    providers = resilience.status()
+    healthy = all(provider["state"] == "closed" for provider in providers.values())
+    return {"status": "ok" if healthy else "degraded", "providers": providers}
+
+@app.get("/metrics",tags=["Monitoramento"], response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Métricas no formato de texto do Prometheus: contadores de /stats, histogramas de duração por etapa
+    da extração (`extraction_stage_seconds`) e por provedor (`llm_request_seconds`, `llm_extraction_seconds`),
+    extrações e chamadas em andamento, bytes recebidos e tokens informados pelos provedores.
+    Os valores são do processo que responde: com vários workers, cada um tem os seus.
+    """
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
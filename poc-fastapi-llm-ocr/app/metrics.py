@@ -0,0 +1,202 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Registro simples de contadores e medidores em memória do processo.
+_lock = threading.Lock()
+_registry = {}
+
+
+class Counter:
+    """
+    Contador monotônico thread-safe, com rótulos opcionais (ex.: provider="gemini"): um valor por série.
+    """
+
+    def __init__(self, name: str, description: str, labelnames: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._series = {}  # valores dos rótulos -> valor
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def samples(self):
+        """
+        Retorna (rótulos, valor) de cada série; sem rótulos, a única série existe desde o início (valor 0).
+        """
+        with self._lock:
+            items = list(self._series.items())
+        if not self.labelnames and not items:
+            items = [((), 0)]
+        for key, value in items:
+            yield dict(zip(self.labelnames, key)), value
+
+    @property
+    def value(self):
+        if not self.labelnames:
+            return self._series.get((), 0)
+        return {",".join(f"{k}={v}" for k, v in labels.items()): value for labels, value in self.samples()}
+
+
+class Gauge(Counter):
+    """
+    Medidor thread-safe: valor que sobe e desce (ex.: tarefas na fila).
+    """
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+# Limites (s) padrão dos buckets dos histogramas de latência
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """
+    Histograma thread-safe com rótulos (ex.: stage="hash"): contagem por bucket, soma e total de cada série.
+    """
+
+    def __init__(self, name: str, description: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # valores dos rótulos -> [contagem por bucket, soma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Mede a duração do bloco `with` (também quando ele termina com erro).
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        """
+        Retorna (rótulos, buckets acumulados, soma, total) de cada série.
+        """
+        with self._lock:
+            items = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+        for key, counts, total_sum, count in items:
+            cumulative, running = [], 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                running += bucket_count
+                cumulative.append((bound, running))
+            yield dict(zip(self.labelnames, key)), cumulative, total_sum, count
+
+    @property
+    def value(self) -> dict:
+        return {
+            ",".join(f"{k}={v}" for k, v in labels.items()) or "total": {"count": count, "sum": round(total_sum, 6)}
+            for labels, _, total_sum, count in self.samples()
+        }
+
+
+def _get_or_create(cls, name: str, description: str, **options):
+    with _lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, description, **options)
+            _registry[name] = metric
+        return metric
+
+
+def counter(name: str, description: str, labelnames: tuple = ()) -> Counter:
+    """
+    Retorna o contador registrado com o nome informado, criando-o se necessário.
+    """
+    return _get_or_create(Counter, name, description, labelnames=labelnames)
+
+
+def gauge(name: str, description: str, labelnames: tuple = ()) -> Gauge:
+    """
+    Retorna o medidor registrado com o nome informado, criando-o se necessário.
+    """
+    return _get_or_create(Gauge, name, description, labelnames=labelnames)
+
+
+def histogram(name: str, description: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    """
+    Retorna o histograma registrado com o nome informado, criando-o se necessário.
+    """
+    return _get_or_create(Histogram, name, description, labelnames=labelnames, buckets=buckets)
+
+
+def snapshot() -> dict:
+    """
+    Retorna o valor atual de todas as métricas registradas.
+    """
+    with _lock:
+        return {name: metric.value for name, metric in _registry.items()}
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_prometheus() -> str:
+    """
+    Retorna todas as métricas no formato de texto do Prometheus (exposition format 0.0.4).
+    """
+    with _lock:
+        metrics = sorted(_registry.values(), key=lambda metric: metric.name)
+    lines = []
+    for metric in metrics:
+        kind = "histogram" if isinstance(metric, Histogram) else "gauge" if isinstance(metric, Gauge) else "counter"
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {kind}")
+        if kind != "histogram":
+            for labels, value in metric.samples():
+                lines.append(f"{metric.name}{_format_labels(labels)} {_format_value(value)}")
+            continue
+        for labels, buckets, total_sum, count in metric.samples():
+            for bound, cumulative in buckets:
+                lines.append(f"{metric.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{metric.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{metric.name}_sum{_format_labels(labels)} {_format_value(total_sum)}")
+            lines.append(f"{metric.name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
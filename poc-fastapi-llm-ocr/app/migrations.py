@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.exc import DBAPIError
+
+from app import models  # noqa: F401 (registra as tabelas em Base.metadata)
+from app.database import Base
+from app.invoice_fields import parse_data_emissao, parse_valor_centavos
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def _add_missing_columns(connection, table) -> list[str]:
+    """
+    Adiciona ao banco as colunas do modelo que ainda não existem na tabela. Retorna os nomes criados.
+    """
+    existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        ddl_type = column.type.compile(dialect=connection.dialect)
+        connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {ddl_type}'))
+        logger.warning("Migração: coluna %s.%s criada.", table.name, column.name)
+        added.append(column.name)
+    return added
+
+
+def _backfill_invoices(connection) -> None:
+    """
+    Preenche data_emissao_iso e valor_total_centavos a partir dos textos gravados (notas anteriores
+    às colunas tipadas ou convertidas por uma versão antiga de parse_valor_centavos).
+    """
+    update = text(
+        "UPDATE invoices SET data_emissao_iso = :data_emissao_iso, valor_total_centavos = :valor_total_centavos "
+        "WHERE id = :invoice_id"
+    ).bindparams(bindparam("data_emissao_iso", type_=Base.metadata.tables["invoices"].c.data_emissao_iso.type))
+
+    last_id, total = 0, 0
+    while True:
+        rows = connection.execute(
+            text("SELECT id, data_emissao, valor_total FROM invoices WHERE id > :last_id ORDER BY id LIMIT :batch"),
+            {"last_id": last_id, "batch": BACKFILL_BATCH_SIZE},
+        ).all()
+        if not rows:
+            break
+        connection.execute(update, [
+            {
+                "invoice_id": invoice_id,
+                "data_emissao_iso": parse_data_emissao(data_emissao),
+                "valor_total_centavos": parse_valor_centavos(valor_total),
+            }
+            for invoice_id, data_emissao, valor_total in rows
+        ])
+        last_id = rows[-1][0]
+        total += len(rows)
+    logger.warning("Migração: %d notas convertidas para as colunas tipadas.", total)
+
+
+# Conversões de dados que rodam uma única vez por banco, registradas em schema_migrations.
+# invoices_valor_centavos_v2 preenche as colunas tipadas das notas antigas e corrige as convertidas
+# por uma versão anterior de parse_valor_centavos ("1,234.56" e "1.234" viravam centavos errados).
+DATA_MIGRATIONS = (
+    ("invoices_valor_centavos_v2", _backfill_invoices),
+)
+
+
+def _run_data_migrations(connection) -> None:
+    connection.execute(text("CREATE TABLE IF NOT EXISTS schema_migrations (name VARCHAR(64) PRIMARY KEY)"))
+    applied = set(connection.execute(text("SELECT name FROM schema_migrations")).scalars())
+    for name, migrate in DATA_MIGRATIONS:
+        if name in applied:
+            continue
+        migrate(connection)
+        connection.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
+        logger.warning("Migração: %s aplicada.", name)
+
+
+def _lock_path(engine) -> str | None:
+    url = engine.url
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            return None
+        return url.database + ".migrate.lock"
+    key = hashlib.sha1(url.render_as_string(hide_password=True).encode()).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"poc-fastapi-llm-ocr-migrate-{key}.lock")
+
+
+@contextmanager
+def _migration_lock(engine):
+    """
+    Trava de arquivo em volta das migrações: com vários workers do uvicorn importando a aplicação
+    ao mesmo tempo, um migra e os outros esperam e encontram o banco já atualizado.
+    """
+    path = _lock_path(engine)
+    try:
+        import fcntl
+    except ImportError:  # Windows: sem flock, as etapas ainda toleram objetos já criados
+        fcntl = None
+    if path is None or fcntl is None:
+        yield
+        return
+    with open(path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _step(engine, description: str, apply, done) -> None:
+    """
+    Executa uma etapa da migração em uma transação. Se ela falhar porque outro processo já criou
+    o objeto (`done(connection)` verdadeiro), segue em frente.
+    """
+    try:
+        with engine.begin() as connection:
+            apply(connection)
+    except DBAPIError:
+        with engine.connect() as connection:
+            if not done(connection):
+                raise
+        logger.warning("Migração: %s já feita por outro processo.", description)
+
+
+def _has_columns(connection, table) -> bool:
+    existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    return {column.name for column in table.columns} <= existing
+
+
+def _has_index(connection, index) -> bool:
+    return index.name in {i["name"] for i in inspect(connection).get_indexes(index.table.name)}
+
+
+def _data_migrations_done(connection) -> bool:
+    if not inspect(connection).has_table("schema_migrations"):
+        return False
+    applied = set(connection.execute(text("SELECT name FROM schema_migrations")).scalars())
+    return {name for name, _ in DATA_MIGRATIONS} <= applied
+
+
+def run_migrations(engine) -> None:
+    """
+    Cria as tabelas novas e atualiza as existentes (ex.: invoices.db de versões anteriores)
+    com as colunas e índices adicionados depois.
+    """
+    tables = Base.metadata.sorted_tables
+    with _migration_lock(engine):
+        for table in tables:
+            _step(engine, f"tabela {table.name}",
+                  lambda connection, table=table: table.create(connection, checkfirst=True),
+                  lambda connection, table=table: inspect(connection).has_table(table.name))
+            _step(engine, f"colunas de {table.name}",
+                  lambda connection, table=table: _add_missing_columns(connection, table),
+                  lambda connection, table=table: _has_columns(connection, table))
+        _step(engine, "migrações de dados", _run_data_migrations, _data_migrations_done)
+        # índices depois do backfill, para não atualizá-los linha a linha
+        for table in tables:
+            for index in table.indexes:
+                _step(engine, f"índice {index.name}",
+                      lambda connection, index=index: index.create(connection, checkfirst=True),
+                      lambda connection, index=index: _has_index(connection, index))
@@ -0,0 +1,29 @@
+import json
+import threading
+
+import google.generativeai as genai
+
+# Instâncias de GenerativeModel reutilizadas entre requisições, por nome e parâmetros.
+_models = {}
+_lock = threading.Lock()
+
+
+def get_model(name: str, **kwargs) -> genai.GenerativeModel:
+    """
+    Retorna o modelo Gemini `name` com os parâmetros informados (generation_config etc.),
+    criando-o apenas na primeira chamada.
+    """
+    key = (name, json.dumps(kwargs, sort_keys=True, default=str))
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = genai.GenerativeModel(name, **kwargs)
+                _models[key] = model
+    return model
+
+
+def clear() -> None:
+    with _lock:
+        _models.clear()
@@ -1,5 +1,7 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, LargeBinary, DateTime, Date, Index
+from sqlalchemy.orm import validates
 from app.database import Base
+from app.invoice_fields import parse_data_emissao, parse_valor_centavos
 from sqlalchemy import Enum
 import enum
 
@@ -11,6 +13,7 @@ class Configurations(Base):
     __tablename__ = 'configurations'
     id = Column(Integer, primary_key=True)
     prompt = Column(String(2048))
+    version = Column(Integer, default=1) # incrementada a cada PUT /configuration (invalida caches)
 
 class Item(Base):
     __tablename__ = 'items'
@@ -20,12 +23,46 @@ class Item(Base):
 
 class Invoice(Base):
     __tablename__ = 'invoices'
+    # (cnpj, status) atende tanto o filtro só por CNPJ quanto CNPJ + status
+    __table_args__ = (Index("ix_invoices_cnpj_status", "cnpj", "status"),)
     id = Column(Integer, primary_key=True)
     cnpj = Column(String(20))
     data_emissao = Column(String(10))
     valor_total = Column(String(64))
-    status = Column(String(10),default="PENDENTE") # PENDENTE / CONFERIDO
+    status = Column(String(10),default="PENDENTE", index=True) # PENDENTE / CONFERIDO
     imagem_hash = Column(String(64), unique=True)
+    imagem_phash = Column(String(16), index=True) # hash perceptual (dHash) para achar notas quase iguais
+    # cópias tipadas de data_emissao/valor_total, preenchidas na gravação; usadas em filtros, ordenação e somas
+    data_emissao_iso = Column(Date, index=True)
+    valor_total_centavos = Column(Integer, index=True)
+
+    @validates("data_emissao")
+    def _set_data_emissao_iso(self, key, value):
+        self.data_emissao_iso = parse_data_emissao(value)
+        return value
+
+    @validates("valor_total")
+    def _set_valor_total_centavos(self, key, value):
+        self.valor_total_centavos = parse_valor_centavos(value)
+        return value
+
+
+class ExtractionJob(Base):
+    __tablename__ = 'extraction_jobs'
+    id = Column(Integer, primary_key=True)
+    invoice_id = Column(Integer, index=True)
+    filename = Column(String(256))
+    content_type = Column(String(64))
+    payload = Column(LargeBinary) # imagem enviada; removida quando o job termina
+    status = Column(String(10), default="QUEUED", index=True) # QUEUED / LEASED / DONE / DEAD
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    available_at = Column(DateTime) # próxima tentativa permitida (backoff)
+    lease_owner = Column(String(64))
+    lease_expires_at = Column(DateTime)
+    last_error = Column(String(1024))
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
 
 
 # https://dennisivy.com/fast-api-crud
@@ -0,0 +1,186 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from PIL import Image
+import pytesseract
+
+from app import image_preprocess, metrics
+
+logger = logging.getLogger(__name__)
+
+# OCR com Tesseract é CPU-bound: roda em um pool de processos para não travar
+# o event loop e para escalar com o número de núcleos.
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_LANG = os.getenv("OCR_LANG", "por")
+# auto: usa tesserocr se estiver instalado, senão pytesseract
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto")
+
+OCR_JOBS = metrics.counter("ocr_jobs_total", "Imagens processadas pelo OCR.")
+OCR_FAILURES = metrics.counter("ocr_failures_total", "Execuções de OCR que falharam.")
+OCR_PENDING = metrics.gauge("ocr_jobs_pending", "Imagens enviadas ao pool de OCR e ainda não concluídas.")
+OCR_QUEUE_DEPTH = metrics.gauge("ocr_queue_depth", "Imagens aguardando um processo livre no pool de OCR.")
+OCR_WAIT_SECONDS = metrics.counter("ocr_wait_seconds_total", "Tempo total de espera na fila do pool de OCR.")
+OCR_RUN_SECONDS = metrics.counter("ocr_run_seconds_total", "Tempo total de execução do OCR nos processos do pool.")
+OCR_POOL_SIZE = metrics.gauge("ocr_pool_size", "Processos no pool de OCR.")
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+class PytesseractBackend:
+    """
+    Chama o binário `tesseract` a cada imagem (recarrega o traineddata toda vez).
+    """
+    name = "pytesseract"
+
+    def __init__(self, lang: str):
+        self.lang = lang
+
+    def image_to_string(self, image: Image.Image) -> str:
+        return pytesseract.image_to_string(image, lang=self.lang)
+
+    def close(self) -> None:
+        pass
+
+
+class TesserocrBackend:
+    """
+    Mantém uma instância da API do Tesseract carregada em memória e a reutiliza entre imagens.
+    """
+    name = "tesserocr"
+
+    def __init__(self, lang: str):
+        import tesserocr
+
+        self.lang = lang
+        self._api = tesserocr.PyTessBaseAPI(lang=lang)
+
+    def image_to_string(self, image: Image.Image) -> str:
+        self._api.SetImage(image)
+        try:
+            return self._api.GetUTF8Text()
+        finally:
+            self._api.Clear()
+
+    def close(self) -> None:
+        self._api.End()
+
+
+def create_backend(name: str = OCR_BACKEND, lang: str = OCR_LANG):
+    """
+    Cria o backend de OCR configurado. Se o tesserocr não estiver disponível (pacote ou
+    traineddata ausentes), usa o pytesseract.
+    """
+    if name in ("tesserocr", "auto"):
+        try:
+            return TesserocrBackend(lang)
+        except Exception as e:
+            if name == "tesserocr":
+                logger.warning("tesserocr indisponível (%s); usando pytesseract.", e)
+    return PytesseractBackend(lang)
+
+
+# Backend do processo atual; nos processos do pool é criado uma única vez no startup
+_backend = None
+
+
+def _init_worker(backend_name: str, lang: str) -> None:
+    global _backend
+    _backend = create_backend(backend_name, lang)
+
+
+def _warm_up() -> str:
+    return _backend.name if _backend else ""
+
+
+def _run_ocr(image_data: bytes, lang: str) -> tuple[str, float, float]:
+    """
+    Executa no processo do pool. Retorna o texto, o tempo gasto no OCR e o tempo de pré-processamento.
+    """
+    global _backend
+    if _backend is None or _backend.lang != lang:
+        # libera a instância do Tesseract (e o traineddata carregado) do idioma anterior
+        if _backend is not None:
+            _backend.close()
+        _backend = create_backend(OCR_BACKEND, lang)
+
+    started = time.perf_counter()
+    if image_preprocess.IMAGE_PREPROCESS:
+        image = image_preprocess.prepare(image_data, image_preprocess.IMAGE_OCR_MAX_EDGE)
+    else:
+        image = Image.open(io.BytesIO(image_data))
+    preprocess_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    try:
+        text = _backend.image_to_string(image)
+    finally:
+        image.close()
+    return text, time.perf_counter() - started, preprocess_seconds
+
+
+def start_pool() -> ProcessPoolExecutor:
+    """
+    Cria o pool de processos de OCR. Chamado no startup da aplicação.
+
+    Usa spawn, como o pool de documents: um fork copiaria o processo da API com as threads e o event
+    loop rodando. O estado de cada processo é montado por _init_worker, nada vem herdado da memória.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=max(1, OCR_WORKERS),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(OCR_BACKEND, OCR_LANG),
+        )
+        OCR_POOL_SIZE.set(max(1, OCR_WORKERS))
+        # Dispara a criação dos processos (e o carregamento do Tesseract) já no startup
+        for _ in range(max(1, OCR_WORKERS)):
+            _executor.submit(_warm_up)
+    return _executor
+
+
+def shutdown_pool() -> None:
+    """
+    Encerra o pool de OCR. Chamado no shutdown da aplicação.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        OCR_POOL_SIZE.set(0)
+
+
+async def image_to_string(image_data: bytes, lang: str = OCR_LANG) -> str:
+    """
+    Extrai o texto dos bytes da imagem usando um processo do pool, sem bloquear o event loop.
+    A imagem é decodificada direto da memória no processo do pool, sem arquivo temporário.
+    """
+    executor = start_pool()
+    loop = asyncio.get_running_loop()
+
+    OCR_PENDING.inc()
+    OCR_QUEUE_DEPTH.set(max(0, OCR_PENDING.value - OCR_POOL_SIZE.value))
+    submitted = time.perf_counter()
+    try:
+        text, run_seconds, preprocess_seconds = await loop.run_in_executor(executor, _run_ocr, image_data, lang)
+    except Exception:
+        OCR_FAILURES.inc()
+        raise
+    finally:
+        OCR_PENDING.dec()
+        OCR_QUEUE_DEPTH.set(max(0, OCR_PENDING.value - OCR_POOL_SIZE.value))
+
+    OCR_JOBS.inc()
+    OCR_RUN_SECONDS.inc(run_seconds)
+    OCR_WAIT_SECONDS.inc(max(0.0, time.perf_counter() - submitted - run_seconds - preprocess_seconds))
+    if image_preprocess.IMAGE_PREPROCESS:
+        image_preprocess.PREPROCESS_TOTAL.inc()
+        image_preprocess.PREPROCESS_SECONDS.inc(preprocess_seconds)
+    return text
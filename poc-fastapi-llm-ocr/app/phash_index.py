@@ -0,0 +1,144 @@
+import os
+import threading
+from itertools import combinations
+from typing import Optional
+
+from sqlalchemy import func
+
+from app.env_util import env_flag
+from app.models import Invoice
+
+# Distância de Hamming máxima (em bits, de 64) para considerar duas notas quase iguais
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+# Se verdadeiro, uma nota quase igual a outra já cadastrada é tratada como duplicada (sem chamar o LLM)
+PHASH_SKIP_NEAR_DUPLICATES = env_flag("PHASH_SKIP_NEAR_DUPLICATES", "false")
+
+_CHUNKS = 4
+_CHUNK_BITS = 16
+_CHUNK_MASK = (1 << _CHUNK_BITS) - 1
+
+
+def _chunks(value: int) -> list[int]:
+    return [(value >> (i * _CHUNK_BITS)) & _CHUNK_MASK for i in range(_CHUNKS)]
+
+
+def _neighbors(chunk: int, radius: int):
+    """
+    Todos os valores de 16 bits a no máximo `radius` bits de `chunk`.
+    """
+    yield chunk
+    for flips in range(1, radius + 1):
+        for positions in combinations(range(_CHUNK_BITS), flips):
+            value = chunk
+            for position in positions:
+                value ^= 1 << position
+            yield value
+
+
+class PerceptualHashIndex:
+    """
+    Índice multi-index hashing de hashes perceptuais de 64 bits.
+
+    O hash é dividido em 4 blocos de 16 bits, cada um com sua tabela. Pelo princípio da casa dos
+    pombos, se dois hashes estão a até d bits de distância, algum bloco difere em no máximo d // 4
+    bits; basta então sondar, em cada tabela, os vizinhos do bloco dentro desse raio e conferir a
+    distância completa só dos candidatos. A busca não depende do número de notas cadastradas.
+    """
+
+    def __init__(self):
+        self._tables = [dict() for _ in range(_CHUNKS)]
+        self._hashes = {}  # invoice_id -> hash
+        # maior id lido do banco em `refresh`; notas gravadas por este processo não o avançam, senão
+        # as gravadas por outros workers com id menor (e ainda não lidas) nunca seriam carregadas
+        self._last_id = 0
+        self._added_locally = set()  # ids adicionados por `add` acima de _last_id
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, invoice_id: int, phash: str) -> None:
+        with self._lock:
+            if invoice_id > self._last_id:
+                self._added_locally.add(invoice_id)
+            self._insert(invoice_id, int(phash, 16))
+
+    def _insert(self, invoice_id: int, value: int) -> None:
+        if invoice_id in self._hashes:
+            return
+        self._hashes[invoice_id] = value
+        for table, chunk in zip(self._tables, _chunks(value)):
+            table.setdefault(chunk, set()).add(invoice_id)
+
+    def remove(self, invoice_id: int) -> None:
+        with self._lock:
+            self._added_locally.discard(invoice_id)
+            value = self._hashes.pop(invoice_id, None)
+            if value is None:
+                return
+            for table, chunk in zip(self._tables, _chunks(value)):
+                bucket = table.get(chunk)
+                if bucket:
+                    bucket.discard(invoice_id)
+                    if not bucket:
+                        del table[chunk]
+
+    def search(self, phash: str, max_distance: int = PHASH_MAX_DISTANCE) -> Optional[tuple[int, int]]:
+        """
+        Retorna (invoice_id, distância) da nota mais parecida dentro de `max_distance`, ou None.
+        """
+        value = int(phash, 16)
+        radius = max_distance // _CHUNKS
+        best = None
+        with self._lock:
+            seen = set()
+            for table, chunk in zip(self._tables, _chunks(value)):
+                for probe in _neighbors(chunk, radius):
+                    for invoice_id in table.get(probe, ()):
+                        if invoice_id in seen:
+                            continue
+                        seen.add(invoice_id)
+                        distance = (self._hashes[invoice_id] ^ value).bit_count()
+                        if distance <= max_distance and (best is None or distance < best[1]):
+                            best = (invoice_id, distance)
+        return best
+
+    def refresh(self, session) -> None:
+        """
+        Carrega as notas gravadas depois da última sincronização (inclusive por outros processos).
+        """
+        # o watermark vai até o maior id da tabela, tenha a nota hash perceptual ou não: notas sem
+        # ele (antigas, de /invoices/add, PDF/TIFF) não são relidas a cada busca
+        last_id = session.query(func.max(Invoice.id)).scalar()
+        if last_id is None or last_id <= self._last_id:
+            return
+        rows = (
+            session.query(Invoice.id, Invoice.imagem_phash)
+            .filter(Invoice.id > self._last_id, Invoice.id <= last_id, Invoice.imagem_phash.isnot(None))
+            .all()
+        )
+        with self._lock:
+            for invoice_id, phash in rows:
+                if invoice_id not in self._added_locally:
+                    self._insert(invoice_id, int(phash, 16))
+            self._last_id = max(self._last_id, last_id)
+            # as notas locais até o novo watermark já vieram do banco
+            self._added_locally = {i for i in self._added_locally if i > self._last_id}
+
+    def find(self, session, phash: str, max_distance: int = PHASH_MAX_DISTANCE):
+        """
+        Retorna (Invoice, distância) da nota cadastrada mais parecida, ou None.
+        """
+        self.refresh(session)
+        while True:
+            match = self.search(phash, max_distance)
+            if match is None:
+                return None
+            invoice = session.get(Invoice, match[0])
+            if invoice is not None:
+                return invoice, match[1]
+            # a nota foi excluída depois de indexada
+            self.remove(match[0])
+
+
+index = PerceptualHashIndex()
@@ -0,0 +1,375 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from google.api_core import exceptions as google_exceptions
+
+from app import metrics
+from app.env_util import env_flag
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Tentativas por chamada (inclui a primeira) para erros 429/5xx e falhas de conexão
+LLM_RETRY_ATTEMPTS = int(os.getenv("LLM_RETRY_ATTEMPTS", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# Espera máxima (s) por capacidade no limitador antes de responder 429
+LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT", "30"))
+# Circuit breaker: falhas seguidas que abrem o circuito e tempo (s) até a próxima tentativa
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+# Com o circuito do Gemini aberto, a extração usa o Tesseract+Mistral
+LLM_FALLBACK = env_flag("LLM_FALLBACK", "true")
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+REQUEST_SECONDS = metrics.histogram(
+    "llm_request_seconds", "Duração de cada tentativa de chamada a um provedor de LLM.", labelnames=("provider", "outcome")
+)
+CALLS = metrics.counter("llm_calls_total", "Chamadas (tentativas) aos provedores de LLM.", labelnames=("provider",))
+RETRIES = metrics.counter("llm_retries_total", "Novas tentativas de chamadas aos provedores de LLM.", labelnames=("provider",))
+FAILURES = metrics.counter(
+    "llm_failures_total", "Chamadas aos provedores de LLM que falharam após as tentativas.", labelnames=("provider",)
+)
+CIRCUIT_REJECTIONS = metrics.counter(
+    "llm_circuit_rejections_total", "Chamadas recusadas com o circuito do provedor aberto.", labelnames=("provider",)
+)
+THROTTLED_SECONDS = metrics.counter(
+    "llm_throttled_seconds_total", "Tempo de espera no limitador de taxa de cada provedor.", labelnames=("provider",)
+)
+IN_FLIGHT = metrics.gauge("llm_in_flight", "Chamadas aos provedores de LLM em andamento.", labelnames=("provider",))
+PROMPT_TOKENS = metrics.counter("llm_prompt_tokens_total", "Tokens de entrada informados pelos provedores.", labelnames=("provider",))
+COMPLETION_TOKENS = metrics.counter(
+    "llm_completion_tokens_total", "Tokens de saída informados pelos provedores.", labelnames=("provider",)
+)
+
+
+class CircuitOpenError(HTTPException):
+    """
+    O provedor está com o circuito aberto: a chamada falha na hora, sem ir ao provedor.
+    """
+
+    def __init__(self, provider: str, retry_in: float):
+        super().__init__(
+            status_code=503,
+            detail=f"Provedor {provider} indisponível no momento; tente novamente em {retry_in:.0f} s.",
+            headers={"Retry-After": str(max(1, round(retry_in)))},
+        )
+        self.provider = provider
+
+
+class RateLimitExceeded(HTTPException):
+    def __init__(self, provider: str, wait: float):
+        super().__init__(
+            status_code=429,
+            detail=f"Limite de requisições do provedor {provider} atingido.",
+            headers={"Retry-After": str(max(1, round(wait)))},
+        )
+
+
+class TokenBucket:
+    """
+    Balde de fichas reabastecido continuamente a `per_minute` fichas por minuto (capacidade de um minuto).
+    As fichas são reservadas na hora; o saldo negativo vira o tempo que a chamada deve esperar.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self._tokens = per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Reserva `amount` fichas e retorna quantos segundos esperar até que elas existam.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= min(amount, self.capacity)
+            return max(0.0, -self._tokens / self.rate)
+
+    def refund(self, amount: float) -> None:
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + min(amount, self.capacity))
+
+    @property
+    def available(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class CircuitBreaker:
+    """
+    Fechado: chamadas normais. Aberto (após `threshold` falhas seguidas): falha na hora por `reset_timeout`.
+    Meio-aberto: deixa passar uma chamada de teste; sucesso fecha o circuito, falha o reabre.
+    """
+
+    def __init__(self, threshold: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def retry_in(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "open":
+                return False
+            # meio-aberto: uma chamada de teste por vez (uma chamada de teste abandonada expira)
+            now = time.monotonic()
+            if self._probe_at is None or now - self._probe_at > self.reset_timeout:
+                self._probe_at = now
+                return True
+            return False
+
+    def release_probe(self) -> None:
+        """
+        Libera a chamada de teste sem mudar o estado do circuito (a chamada não disse se o provedor voltou).
+        """
+        with self._lock:
+            self._probe_at = None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe_at = None
+
+    def record_failure(self) -> bool:
+        """
+        Registra uma falha; retorna True se o circuito abriu agora.
+        """
+        with self._lock:
+            self.failures += 1
+            self._probe_at = None
+            if self.opened_at is not None or self.failures >= self.threshold:
+                was_closed = self.opened_at is None
+                self.opened_at = time.monotonic()
+                return was_closed
+            return False
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Erros transitórios do provedor: 429, 5xx, timeouts e falhas de conexão.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, google_exceptions.GoogleAPICallError):
+        return error.code in RETRYABLE_STATUS
+    return isinstance(error, (google_exceptions.RetryError, ConnectionError, TimeoutError))
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    if isinstance(error, httpx.HTTPStatusError):
+        value = error.response.headers.get("Retry-After")
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+    return None
+
+
+def backoff_delay(attempt: int, error: Optional[BaseException] = None) -> float:
+    """
+    Espera antes da tentativa `attempt + 1`: exponencial com jitter completo, ou o Retry-After do provedor.
+    """
+    retry_after = _retry_after(error) if error is not None else None
+    if retry_after is not None:
+        return min(LLM_RETRY_MAX_DELAY, retry_after)
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def estimate_tokens(*texts: str, max_tokens: int = 0, images: int = 0) -> int:
+    """
+    Estimativa de tokens de uma chamada (≈ 4 caracteres por token, 258 por imagem) para o limite por minuto.
+    """
+    return sum(len(text or "") for text in texts) // 4 + max_tokens + 258 * images
+
+
+class Provider:
+    """
+    Limites de taxa, retentativas e circuit breaker de um provedor de LLM.
+    """
+
+    def __init__(self, name: str, rpm: float, tpm: float):
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.breaker = CircuitBreaker()
+        # séries do provedor zeradas desde o início, para aparecerem em /metrics antes da primeira chamada
+        for metric in (CALLS, RETRIES, FAILURES, CIRCUIT_REJECTIONS, THROTTLED_SECONDS, IN_FLIGHT, PROMPT_TOKENS, COMPLETION_TOKENS):
+            metric.inc(0, provider=name)
+
+    def _check_circuit(self) -> None:
+        if not self.breaker.allow():
+            CIRCUIT_REJECTIONS.inc(provider=self.name)
+            raise CircuitOpenError(self.name, self.breaker.retry_in())
+
+    def _reserve(self, tokens: int) -> float:
+        waits = []
+        if self.requests is not None:
+            waits.append(self.requests.reserve(1))
+        if self.tokens is not None and tokens:
+            waits.append(self.tokens.reserve(tokens))
+        wait = max(waits, default=0.0)
+        if wait > LLM_RATE_LIMIT_MAX_WAIT:
+            if self.requests is not None:
+                self.requests.refund(1)
+            if self.tokens is not None and tokens:
+                self.tokens.refund(tokens)
+            raise RateLimitExceeded(self.name, wait)
+        if wait:
+            THROTTLED_SECONDS.inc(wait, provider=self.name)
+        return wait
+
+    def _on_error(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        Decide o que fazer após um erro: retorna a espera até a próxima tentativa ou None para desistir.
+        """
+        if not is_retryable(error):
+            # erro da própria requisição (ex.: 400/401): não conta como falha nem como sucesso do provedor
+            self.breaker.release_probe()
+            return None
+        if attempt + 1 >= LLM_RETRY_ATTEMPTS:
+            FAILURES.inc(provider=self.name)
+            if self.breaker.record_failure():
+                logger.warning("Circuito do provedor %s aberto após %s falhas seguidas.", self.name, self.breaker.failures)
+            return None
+        RETRIES.inc(provider=self.name)
+        delay = backoff_delay(attempt, error)
+        logger.warning("Provedor %s falhou (%s); nova tentativa em %.2f s.", self.name, error, delay)
+        return delay
+
+    @contextmanager
+    def _attempt(self):
+        """
+        Conta a tentativa como em andamento e registra a duração dela por resultado (ok, error, cancelled).
+        """
+        CALLS.inc(provider=self.name)
+        IN_FLIGHT.inc(provider=self.name)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            IN_FLIGHT.dec(provider=self.name)
+            REQUEST_SECONDS.observe(time.perf_counter() - started, provider=self.name, outcome=outcome)
+
+    def record_usage(self, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> None:
+        """
+        Soma os tokens informados pelo provedor na resposta (quando ele os informa).
+        """
+        PROMPT_TOKENS.inc(prompt_tokens or 0, provider=self.name)
+        COMPLETION_TOKENS.inc(completion_tokens or 0, provider=self.name)
+
+    async def call(self, fn: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        """
+        Executa a chamada assíncrona `fn` com limite de taxa, retentativas e circuit breaker.
+        """
+        self._check_circuit()
+        for attempt in range(max(1, LLM_RETRY_ATTEMPTS)):
+            wait = self._reserve(tokens)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                with self._attempt():
+                    result = await fn()
+            except Exception as e:
+                delay = self._on_error(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    async def call_in_thread(self, fn: Callable[[], T], tokens: int = 0) -> T:
+        """
+        Como `call`, para chamadas bloqueantes (SDK do Gemini) feitas nas rotas: só cada tentativa roda no
+        threadpool; as esperas do limitador e entre tentativas ficam no event loop, sem ocupar threads.
+        """
+        return await self.call(lambda: run_in_threadpool(fn), tokens)
+
+    def call_sync(self, fn: Callable[[], T], tokens: int = 0) -> T:
+        """
+        Como `call`, para chamadas bloqueantes fora de um event loop (worker da fila): as esperas bloqueiam
+        a thread. Nas rotas use `call_in_thread`.
+        """
+        self._check_circuit()
+        for attempt in range(max(1, LLM_RETRY_ATTEMPTS)):
+            wait = self._reserve(tokens)
+            if wait:
+                time.sleep(wait)
+            try:
+                with self._attempt():
+                    result = fn()
+            except Exception as e:
+                delay = self._on_error(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def status(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "retry_in_seconds": round(self.breaker.retry_in(), 1),
+            "requests_available": round(self.requests.available, 1) if self.requests else None,
+            "tokens_available": round(self.tokens.available) if self.tokens else None,
+        }
+
+
+# Limites por minuto de cada provedor (0 = sem limite). São por processo: com vários workers,
+# divida a cota do provedor entre eles.
+gemini = Provider("gemini", float(os.getenv("GEMINI_RPM", "60")), float(os.getenv("GEMINI_TPM", "1000000")))
+mistral = Provider("mistral", float(os.getenv("MISTRAL_RPM", "60")), float(os.getenv("MISTRAL_TPM", "500000")))
+
+providers = {"gemini": gemini, "mistral": mistral}
+
+
+def status() -> dict:
+    return {name: provider.status() for name, provider in providers.items()}
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app import metrics
+from app.env_util import env_flag
+
+logger = logging.getLogger(__name__)
+
+
+# Cache de respostas de /chat/gemini e /chat/mistral para prompts repetidos.
+CHAT_CACHE_ENABLED = env_flag("CHAT_CACHE_ENABLED", "true")
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "1000"))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "3600"))
+# Temperaturas acima deste valor geram respostas diferentes a cada chamada: não usam o cache,
+# a menos que a requisição peça explicitamente (?cache=true)
+CHAT_CACHE_MAX_TEMPERATURE = float(os.getenv("CHAT_CACHE_MAX_TEMPERATURE", "0"))
+# Camada em disco (SQLite) que sobrevive a reinícios; vazio desativa
+CHAT_CACHE_DB = os.getenv("CHAT_CACHE_DB", "")
+CHAT_CACHE_DISK_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_DISK_MAX_ENTRIES", "10000"))
+
+CACHE_HITS = metrics.counter("chat_cache_hits_total", "Respostas de chat servidas pelo cache.")
+CACHE_DISK_HITS = metrics.counter("chat_cache_disk_hits_total", "Respostas de chat servidas pela camada em disco do cache.")
+CACHE_MISSES = metrics.counter("chat_cache_misses_total", "Requisições de chat não encontradas no cache.")
+CACHE_BYPASS = metrics.counter("chat_cache_bypass_total", "Requisições de chat que não usaram o cache (temperatura, stream ou ?cache=false).")
+CACHE_EVICTIONS = metrics.counter("chat_cache_evictions_total", "Respostas removidas do cache em memória por falta de espaço.")
+CACHE_ENTRIES = metrics.gauge("chat_cache_entries", "Respostas no cache em memória.")
+
+
+def _normalize(value):
+    """
+    Normaliza o conteúdo da chave: espaços repetidos e nas pontas não geram entradas diferentes.
+    """
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def make_key(namespace: str, fields: dict) -> str:
+    raw = json.dumps([namespace, _normalize(fields)], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def should_cache(temperature: Optional[float], override: Optional[bool] = None) -> bool:
+    """
+    Decide se a requisição usa o cache. `override` vem de ?cache=true/false; sem ele, só
+    temperaturas até CHAT_CACHE_MAX_TEMPERATURE usam o cache. `temperature=None` (o provedor usa a
+    temperatura padrão dele, maior que zero) só usa o cache com ?cache=true.
+    """
+    if not CHAT_CACHE_ENABLED or override is False:
+        allowed = False
+    elif override:
+        allowed = True
+    else:
+        allowed = temperature is not None and temperature <= CHAT_CACHE_MAX_TEMPERATURE
+    if not allowed:
+        CACHE_BYPASS.inc()
+    return allowed
+
+
+class DiskTier:
+    """
+    Camada persistente do cache em um arquivo SQLite próprio (separado do invoices.db).
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS chat_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ix_chat_cache_accessed_at ON chat_cache (accessed_at)")
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM chat_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE chat_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO chat_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + ttl, now),
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        self._connection.execute("DELETE FROM chat_cache WHERE expires_at <= ?", (now,))
+        self._connection.execute(
+            "DELETE FROM chat_cache WHERE key IN ("
+            "SELECT key FROM chat_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM chat_cache")
+
+
+class ResponseCache:
+    """
+    Cache LRU com TTL em memória, com camada opcional em disco. Na falta em memória a camada
+    em disco é consultada e, se achar, a resposta volta para a memória.
+    """
+
+    def __init__(self, max_entries: int = CHAT_CACHE_MAX_ENTRIES, ttl: float = CHAT_CACHE_TTL,
+                 disk: Optional[DiskTier] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk = disk
+        self._entries: OrderedDict = OrderedDict()  # key -> (expira em, resposta)
+        self._lock = threading.Lock()
+
+    def _memory_get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                CACHE_ENTRIES.set(len(self._entries))
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _memory_set(self, key: str, value) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                CACHE_EVICTIONS.inc()
+            CACHE_ENTRIES.set(len(self._entries))
+
+    async def get(self, key: str):
+        """
+        Retorna a resposta em cache ou None. A consulta ao disco roda fora do event loop.
+        """
+        value = self._memory_get(key)
+        if value is None and self.disk is not None:
+            try:
+                value = await asyncio.to_thread(self.disk.get, key)
+            except sqlite3.Error as e:
+                logger.warning("Falha ao ler o cache em disco: %s", e)
+            if value is not None:
+                CACHE_DISK_HITS.inc()
+                self._memory_set(key, value)
+
+        if value is None:
+            CACHE_MISSES.inc()
+        else:
+            CACHE_HITS.inc()
+        return value
+
+    async def set(self, key: str, value) -> None:
+        self._memory_set(key, value)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value, self.ttl)
+            except sqlite3.Error as e:
+                logger.warning("Falha ao gravar o cache em disco: %s", e)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            CACHE_ENTRIES.set(0)
+        if self.disk is not None:
+            self.disk.clear()
+
+
+cache = ResponseCache(disk=DiskTier(CHAT_CACHE_DB, CHAT_CACHE_DISK_MAX_ENTRIES) if CHAT_CACHE_DB else None)
@@ -32,6 +32,16 @@ class InvoiceRequest(BaseModel):
     imagem_hash: str| None = None  
     status: str| None = None # Novo campo para o status da persistência
 
+# --- Fila de extração ---
+class JobResponse(BaseModel):
+    job_id: int
+    invoice_id: int | None = None
+    status: str # QUEUED / LEASED / DONE / DEAD
+    attempts: int = 0
+    max_attempts: int = 0
+    last_error: str | None = None
+    invoice: InvoiceResponse | None = None
+
 # Esquemas para a requisição e resposta
 class Message(BaseModel):
     role: str  # Ex: "system", "user", "assistant"
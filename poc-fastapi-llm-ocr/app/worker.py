@@ -0,0 +1,143 @@
+"""
+Workers da fila de extração (tabela extraction_jobs).
+
+Uso:
+    python -m app.worker --processes 4
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from app.log_config import logger
+
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# Tempo (s) que o processo principal espera os workers terminarem o job atual antes de matá-los.
+# O job interrompido volta para a fila quando a reserva expira.
+JOB_SHUTDOWN_TIMEOUT = float(os.getenv("JOB_SHUTDOWN_TIMEOUT", "30"))
+# Espera máxima (s) após erros seguidos no loop do worker (ex.: "database is locked")
+# e antes de recriar um processo worker que morreu logo após iniciar.
+JOB_ERROR_BACKOFF_MAX = float(os.getenv("JOB_ERROR_BACKOFF_MAX", "30"))
+
+
+def _error_message(exc: Exception) -> str:
+    # HTTPException guarda a mensagem em `detail`
+    return str(getattr(exc, "detail", None) or exc) or repr(exc)
+
+
+def run_worker(poll_interval: float) -> None:
+    """
+    Loop de um processo worker: reserva um job, extrai os dados com o Gemini e grava o resultado.
+    """
+    # Importado aqui para que cada processo crie seu próprio engine e cliente do Gemini
+    from app import job_queue
+    from app.database import SessionLocal
+    from app.main import extract_fields_with_gemini, get_extraction_prompt
+
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info("Worker %s iniciado.", owner)
+    errors = 0
+    while not stopping:
+        session = SessionLocal()
+        try:
+            job = job_queue.lease(session, owner)
+            if job is None:
+                errors = 0
+                time.sleep(poll_interval)
+                continue
+
+            logger.info("Worker %s processando job %s (tentativa %s).", owner, job.id, job.attempts)
+            try:
+                prompt = get_extraction_prompt(session)
+                json_data = extract_fields_with_gemini(job.payload, job.content_type, prompt)
+            except Exception as e:
+                logger.warning("Job %s falhou: %s", job.id, _error_message(e))
+                job_queue.fail(session, job, owner, _error_message(e))
+            else:
+                job_queue.complete(session, job, owner, json_data)
+            errors = 0
+        except Exception:
+            # erro do banco (ex.: "database is locked") não derruba o worker: o job reservado
+            # volta para a fila quando a reserva expirar
+            errors += 1
+            delay = min(JOB_ERROR_BACKOFF_MAX, poll_interval * 2 ** (errors - 1))
+            logger.exception("Worker %s: erro no loop da fila; nova tentativa em %.1f s.", owner, delay)
+            time.sleep(delay)
+        finally:
+            session.close()
+    logger.info("Worker %s finalizado.", owner)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Workers da fila de extração de notas fiscais.")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("JOB_WORKERS", os.cpu_count() or 1)),
+                        help="Número de processos worker (padrão JOB_WORKERS ou número de núcleos).")
+    parser.add_argument("--poll-interval", type=float, default=JOB_POLL_INTERVAL,
+                        help="Segundos entre consultas quando a fila está vazia.")
+    args = parser.parse_args()
+
+    # spawn: cada processo abre suas próprias conexões com o SQLite
+    context = multiprocessing.get_context("spawn")
+
+    def start() -> multiprocessing.Process:
+        process = context.Process(target=run_worker, args=(args.poll_interval,), daemon=False)
+        process.start()
+        return process
+
+    processes = [start() for _ in range(max(1, args.processes))]
+    started_at = [time.monotonic()] * len(processes)
+    restart_delay = [1.0] * len(processes)
+    restart_at = [None] * len(processes)
+
+    shutdown = False
+
+    def terminate(signum, frame):
+        nonlocal shutdown
+        shutdown = True
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+
+    # supervisiona os workers: um processo que morre é recriado (com espera crescente se ele
+    # morre logo após iniciar, para não reiniciar em laço um erro de configuração)
+    while not shutdown:
+        time.sleep(1)
+        now = time.monotonic()
+        for slot, process in enumerate(processes):
+            if shutdown or process.is_alive():
+                continue
+            if restart_at[slot] is None:
+                lived = now - started_at[slot]
+                restart_delay[slot] = 1.0 if lived > 60 else min(JOB_ERROR_BACKOFF_MAX, restart_delay[slot] * 2)
+                restart_at[slot] = now + restart_delay[slot]
+                logger.warning("Worker %s morreu (código %s); outro processo em %.0f s.",
+                               process.pid, process.exitcode, restart_delay[slot])
+            elif now >= restart_at[slot]:
+                processes[slot] = start()
+                started_at[slot], restart_at[slot] = time.monotonic(), None
+
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    deadline = time.monotonic() + JOB_SHUTDOWN_TIMEOUT
+    for process in processes:
+        process.join(max(0, deadline - time.monotonic()))
+        if process.is_alive():
+            logger.warning("Worker %s não terminou a tempo; encerrando à força.", process.pid)
+            process.kill()
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Teste de carga concorrente no banco: grava notas em /invoices/add e lista em GET /invoices ao mesmo tempo.
+
+Por padrão sobe o uvicorn com vários workers apontando para um banco SQLite temporário
+(via DATABASE_URL) e conta as falhas ("database is locked" aparece como HTTP 500).
+Para comparar com o modo de journal antigo:
+
+    python -m benchmarks.db_stress --workers 4 --journal-mode DELETE
+    python -m benchmarks.db_stress --workers 4 --journal-mode WAL
+
+Com --url o teste roda contra um servidor já em execução. Se algum worker do uvicorn morrer
+(ex.: erro na migração do startup), o teste termina com erro em vez de medir só os que sobraram.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Linhas do log do uvicorn (nível info) usadas para acompanhar os workers
+STARTUP_COMPLETE = "Application startup complete."
+WORKER_FAILURES = ("died", "Application startup failed", "Traceback (most recent call last)")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, journal_mode: str, db_path: str, log_path: str):
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "SQLITE_JOURNAL_MODE": journal_mode,
+        "OCR_WORKERS": "1",
+    })
+    env.setdefault("GOOGLE_API_KEY", "db-stress")  # nenhuma rota de LLM é chamada
+    log = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "info", "--no-access-log"],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    return process, log, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/invoices", params={"limit": 1})).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise SystemExit("Servidor não respondeu a tempo.")
+
+
+def check_workers(log_path: str, workers: int, timeout: float = 60) -> None:
+    """
+    Espera todos os workers concluírem o startup; falha se algum morrer (o supervisor do uvicorn
+    o substitui, mas a medição já não é a pedida).
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        with open(log_path) as server_log:
+            lines = server_log.read().splitlines()
+        failures = [line for line in lines if any(marker in line for marker in WORKER_FAILURES)]
+        if failures:
+            raise SystemExit(f"Worker do uvicorn falhou ({log_path}):\n" + "\n".join(failures[:10]))
+        if sum(STARTUP_COMPLETE in line for line in lines) >= workers:
+            return
+        if time.monotonic() > deadline:
+            raise SystemExit(f"Só {sum(STARTUP_COMPLETE in line for line in lines)} de {workers} workers subiram ({log_path}).")
+        time.sleep(0.5)
+
+
+async def writer(client: httpx.AsyncClient, stop_at: float, results: list) -> None:
+    while time.monotonic() < stop_at:
+        payload = {
+            "cnpj": f"{uuid.uuid4().int % 10 ** 14:014d}",
+            "data_emissao": "15/03/2024",
+            "valor_total": 123.45,
+            "imagem_hash": uuid.uuid4().hex,
+        }
+        await _timed(client.post("/invoices/add", json=payload), "escrita", results)
+
+
+async def reader(client: httpx.AsyncClient, stop_at: float, results: list) -> None:
+    while time.monotonic() < stop_at:
+        await _timed(client.get("/invoices", params={"limit": 50, "sort": "-id"}), "leitura", results)
+
+
+async def _timed(request, kind: str, results: list) -> None:
+    started = time.perf_counter()
+    try:
+        response = await request
+        outcome = response.status_code
+    except httpx.HTTPError as e:
+        outcome = type(e).__name__
+    results.append((kind, outcome, time.perf_counter() - started))
+
+
+async def run_load(url: str, writers: int, readers: int, duration: float) -> list:
+    limits = httpx.Limits(max_connections=writers + readers)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+        await wait_ready(client)
+        results = []
+        stop_at = time.monotonic() + duration
+        await asyncio.gather(
+            *(writer(client, stop_at, results) for _ in range(writers)),
+            *(reader(client, stop_at, results) for _ in range(readers)),
+        )
+        return results
+
+
+def report(results: list, duration: float) -> None:
+    print(f"{'tipo':<8} {'req':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  respostas")
+    for kind in ("escrita", "leitura"):
+        rows = [r for r in results if r[0] == kind]
+        if not rows:
+            continue
+        timings = sorted(r[2] for r in rows)
+        quantiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+        outcomes = Counter(r[1] for r in rows)
+        print(f"{kind:<8} {len(rows):>7} {len(rows) / duration:>8.1f} {quantiles[49] * 1000:>8.1f} "
+              f"{quantiles[94] * 1000:>8.1f} {quantiles[98] * 1000:>8.1f}  {dict(outcomes)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Teste de carga concorrente em /invoices.")
+    parser.add_argument("--url", help="Servidor já em execução (não sobe o uvicorn).")
+    parser.add_argument("--workers", type=int, default=4, help="Workers do uvicorn.")
+    parser.add_argument("--journal-mode", default="WAL", help="SQLITE_JOURNAL_MODE do servidor (WAL, DELETE...).")
+    parser.add_argument("--writers", type=int, default=16, help="Clientes gravando ao mesmo tempo.")
+    parser.add_argument("--readers", type=int, default=16, help="Clientes listando ao mesmo tempo.")
+    parser.add_argument("--duration", type=float, default=20, help="Duração do teste em segundos.")
+    args = parser.parse_args()
+
+    if args.url:
+        report(asyncio.run(run_load(args.url, args.writers, args.readers, args.duration)), args.duration)
+        return
+
+    workdir = tempfile.mkdtemp()
+    log_path = os.path.join(workdir, "server.log")
+    process, log, url = start_server(args.workers, args.journal_mode, os.path.join(workdir, "invoices.db"), log_path)
+    try:
+        check_workers(log_path, args.workers)
+        print(f"uvicorn com {args.workers} workers, journal_mode={args.journal_mode}, "
+              f"{args.writers} escritores e {args.readers} leitores por {args.duration:.0f} s")
+        results = asyncio.run(run_load(url, args.writers, args.readers, args.duration))
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        log.close()
+
+    with open(log_path) as server_log:
+        log_text = server_log.read()
+    died = log_text.count("died")
+    if died:
+        raise SystemExit(f"{died} worker(s) do uvicorn morreram durante o teste; resultado descartado ({log_path}).")
+    report(results, args.duration)
+    print(f"'database is locked' no log do servidor: {log_text.count('database is locked')}  ({log_path})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Mede consultas por intervalo na tabela invoices antes e depois das colunas tipadas e índices.
+
+Gera um invoices.db sintético com o esquema antigo (data e valor em texto, sem índices),
+mede as consultas, aplica app.migrations.run_migrations e mede de novo.
+
+Uso (a partir da raiz do projeto):
+    python -m benchmarks.invoice_range_query --rows 1000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine
+
+from app.migrations import run_migrations
+
+LEGACY_SCHEMA = """
+CREATE TABLE invoices (
+    id INTEGER PRIMARY KEY,
+    cnpj VARCHAR(20),
+    data_emissao VARCHAR(10),
+    valor_total VARCHAR(64),
+    status VARCHAR(10),
+    imagem_hash VARCHAR(64) UNIQUE
+)
+"""
+
+# data DD/MM/AAAA reordenada para comparar como texto ISO (única opção sem a coluna tipada)
+LEGACY_ISO = "substr(data_emissao, 7, 4) || '-' || substr(data_emissao, 4, 2) || '-' || substr(data_emissao, 1, 2)"
+
+QUERIES = {
+    "notas de um mês": (
+        f"SELECT count(*) FROM invoices WHERE {LEGACY_ISO} BETWEEN :inicio AND :fim",
+        "SELECT count(*) FROM invoices WHERE data_emissao_iso BETWEEN :inicio AND :fim",
+    ),
+    "soma do mês": (
+        f"SELECT sum(CAST(valor_total AS REAL)) FROM invoices WHERE {LEGACY_ISO} BETWEEN :inicio AND :fim",
+        "SELECT sum(valor_total_centavos) FROM invoices WHERE data_emissao_iso BETWEEN :inicio AND :fim",
+    ),
+    "faixa de valor (página)": (
+        "SELECT id FROM invoices WHERE CAST(valor_total AS REAL) BETWEEN :minimo AND :maximo "
+        "ORDER BY CAST(valor_total AS REAL), id LIMIT 100",
+        "SELECT id FROM invoices WHERE valor_total_centavos BETWEEN :minimo * 100 AND :maximo * 100 "
+        "ORDER BY valor_total_centavos, id LIMIT 100",
+    ),
+    "mais recentes (página)": (
+        f"SELECT id FROM invoices ORDER BY {LEGACY_ISO} DESC, id DESC LIMIT 100",
+        "SELECT id FROM invoices ORDER BY data_emissao_iso DESC, id DESC LIMIT 100",
+    ),
+    "cnpj + status": (
+        "SELECT id FROM invoices WHERE cnpj = :cnpj AND status = 'PROCESSADO' ORDER BY id LIMIT 100",
+        "SELECT id FROM invoices WHERE cnpj = :cnpj AND status = 'PROCESSADO' ORDER BY id LIMIT 100",
+    ),
+}
+
+
+def populate(path: str, rows: int, seed: int) -> list[str]:
+    random.seed(seed)
+    cnpjs = [f"{random.randrange(10 ** 14):014d}" for _ in range(2000)]
+    start = date(2018, 1, 1)
+
+    connection = sqlite3.connect(path)
+    connection.execute(LEGACY_SCHEMA)
+    batch = []
+    for invoice_id in range(1, rows + 1):
+        emissao = start + timedelta(days=random.randrange(365 * 7))
+        batch.append((
+            invoice_id,
+            random.choice(cnpjs),
+            emissao.strftime("%d/%m/%Y"),
+            str(round(random.lognormvariate(5, 1.2), 2)),
+            random.choice(("PROCESSADO", "PROCESSADO", "PROCESSADO", "CHECKING", "PEDENTE")),
+            f"{invoice_id:064x}",
+        ))
+        if len(batch) == 50_000:
+            connection.executemany("INSERT INTO invoices VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        connection.executemany("INSERT INTO invoices VALUES (?, ?, ?, ?, ?, ?)", batch)
+    connection.commit()
+    connection.close()
+    return cnpjs
+
+
+def measure(path: str, variant: int, params: dict, repeat: int) -> dict[str, float]:
+    connection = sqlite3.connect(path)
+    results = {}
+    for name, sqls in QUERIES.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            connection.execute(sqls[variant], params).fetchall()
+            timings.append(time.perf_counter() - started)
+        results[name] = statistics.median(timings)
+    connection.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de consultas por intervalo em invoices.")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Quantidade de notas sintéticas.")
+    parser.add_argument("--repeat", type=int, default=5, help="Execuções de cada consulta (usa a mediana).")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", help="Arquivo do banco sintético (padrão: arquivo temporário, removido no fim).")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), "invoices_bench.db")
+    if os.path.exists(path):
+        raise SystemExit(f"{path} já existe")
+
+    started = time.perf_counter()
+    cnpjs = populate(path, args.rows, args.seed)
+    print(f"{args.rows} notas geradas em {time.perf_counter() - started:.1f} s ({path})")
+
+    params = {"inicio": "2021-03-01", "fim": "2021-03-31", "minimo": 1000, "maximo": 1100, "cnpj": cnpjs[0]}
+    before = measure(path, 0, params, args.repeat)
+
+    started = time.perf_counter()
+    engine = create_engine(f"sqlite:///{path}")
+    run_migrations(engine)
+    engine.dispose()
+    print(f"migração (colunas tipadas + backfill + índices) em {time.perf_counter() - started:.1f} s")
+
+    after = measure(path, 1, params, args.repeat)
+
+    print(f"{'consulta':<26} {'antes ms':>10} {'depois ms':>10} {'ganho':>8}")
+    for name in QUERIES:
+        speedup = before[name] / after[name] if after[name] else float("inf")
+        print(f"{name:<26} {before[name] * 1000:>10.1f} {after[name] * 1000:>10.2f} {speedup:>7.0f}x")
+
+    if not args.db:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    main()
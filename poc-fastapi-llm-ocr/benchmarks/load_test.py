@@ -0,0 +1,240 @@
+"""
+Teste de carga das rotas de extração com o servidor falso de LLM (benchmarks/stub_llm.py).
+
+Sobe o stub e o uvicorn (apontado para ele via GEMINI_API_ENDPOINT e MISTRAL_API_URL, com banco
+SQLite temporário), envia as imagens de notas-fiscais às rotas /invoices/extract/* com a
+concorrência pedida e mostra req/s, p50/p95/p99 e o tempo por etapa lido de /metrics:
+
+    python -m benchmarks.load_test --endpoint check --concurrency 16 --requests 500 --latency-ms 800
+    python -m benchmarks.load_test --endpoint hedged --gemini-latency-ms 2000 --mistral-latency-ms 600
+
+Cada envio leva bytes extras no fim do arquivo: o hash muda e a deduplicação não evita a chamada
+ao LLM. A rota `mistral` (e `hedged`) precisa do Tesseract instalado.
+Com --url o teste roda contra um servidor já em execução (o stub não é iniciado).
+"""
+import argparse
+import asyncio
+import glob
+import mimetypes
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import httpx
+
+from benchmarks.db_stress import ROOT, _free_port
+from benchmarks.stub_llm import add_arguments
+
+ENDPOINTS = {
+    "check": "/invoices/extract/check",
+    "save": "/invoices/extract/save",
+    "mistral": "/invoices/extract/mistral",
+    "hedged": "/invoices/extract/hedged",
+}
+
+# Histogramas de /metrics usados no detalhamento por etapa
+STAGE_METRICS = ("extraction_stage_seconds", "llm_request_seconds", "llm_json_parse_seconds")
+_SAMPLE = re.compile(r"^(\w+?)_(bucket|sum|count)(\{[^}]*\})? (\S+)$")
+_LABEL = re.compile(r'(\w+)="([^"]*)"')
+
+
+def start_processes(args, workdir: str):
+    """
+    Sobe o stub de LLM e a API. Retorna (processos, arquivos de log, URL da API).
+    """
+    stub_port, api_port = _free_port(), _free_port()
+    stub_args = [
+        "--port", str(stub_port), "--latency-ms", str(args.latency_ms), "--latency-dist", args.latency_dist,
+        "--latency-sigma", str(args.latency_sigma), "--error-rate", str(args.error_rate),
+        "--error-status", str(args.error_status),
+    ]
+    for option in ("gemini_latency_ms", "mistral_latency_ms", "responses", "seed"):
+        if getattr(args, option) is not None:
+            stub_args += ["--" + option.replace("_", "-"), str(getattr(args, option))]
+
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'invoices.db')}",
+        "GEMINI_API_ENDPOINT": f"http://127.0.0.1:{stub_port}",
+        "MISTRAL_API_URL": f"http://127.0.0.1:{stub_port}/v1/chat/completions",
+        "OCR_WORKERS": str(args.ocr_workers),
+    })
+    env.setdefault("GOOGLE_API_KEY", "load-test")
+    env.setdefault("MISTRAL_API_KEY", "load-test")
+    # sem limite por minuto: o teste mede a API, não a cota dos provedores
+    for name in ("GEMINI_RPM", "GEMINI_TPM", "MISTRAL_RPM", "MISTRAL_TPM"):
+        env.setdefault(name, "0")
+
+    logs = [open(os.path.join(workdir, name), "w") for name in ("stub.log", "server.log")]
+    processes = [
+        subprocess.Popen([sys.executable, "-m", "benchmarks.stub_llm", *stub_args],
+                         cwd=ROOT, env=env, stdout=logs[0], stderr=subprocess.STDOUT),
+        subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(api_port),
+                          "--workers", str(args.workers), "--log-level", "warning"],
+                         cwd=ROOT, env=env, stdout=logs[1], stderr=subprocess.STDOUT),
+    ]
+    return processes, logs, f"http://127.0.0.1:{api_port}"
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/metrics")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise SystemExit("Servidor não respondeu a tempo.")
+
+
+def load_images(pattern: str) -> list[tuple[str, bytes, str]]:
+    images = []
+    for path in sorted(glob.glob(pattern)):
+        content_type = mimetypes.guess_type(path)[0]
+        if content_type and content_type.startswith("image/"):
+            with open(path, "rb") as file:
+                images.append((os.path.basename(path), file.read(), content_type))
+    if not images:
+        raise SystemExit(f"Nenhuma imagem encontrada em {pattern}.")
+    return images
+
+
+async def run_load(client: httpx.AsyncClient, path: str, images: list, concurrency: int, total: int) -> list:
+    """
+    Envia `total` imagens (em rodízio) com até `concurrency` requisições simultâneas.
+    Retorna (status ou erro, duração) de cada requisição.
+    """
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(images[i % len(images)])
+    results = []
+
+    async def worker():
+        while not queue.empty():
+            filename, data, content_type = queue.get_nowait()
+            # bytes extras após o fim da imagem: outro hash, mesma imagem
+            upload = data + uuid.uuid4().bytes
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, files={"file": (filename, upload, content_type)})
+                outcome = response.status_code
+            except httpx.HTTPError as e:
+                outcome = type(e).__name__
+            results.append((outcome, time.perf_counter() - started))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+async def scrape(client: httpx.AsyncClient) -> dict:
+    """
+    Lê os histogramas de STAGE_METRICS em /metrics: {(métrica, rótulos): {"sum", "count", "buckets"}}.
+    """
+    series = defaultdict(lambda: {"sum": 0.0, "count": 0, "buckets": {}})
+    for line in (await client.get("/metrics")).text.splitlines():
+        match = _SAMPLE.match(line)
+        if not match or match.group(1) not in STAGE_METRICS:
+            continue
+        name, kind, labels, value = match.groups()
+        labels = dict(_LABEL.findall(labels or ""))
+        le = labels.pop("le", None)
+        entry = series[(name, tuple(sorted(labels.items())))]
+        if kind == "bucket":
+            entry["buckets"][le] = float(value)
+        else:
+            entry[kind] = float(value)
+    return series
+
+
+def report_requests(endpoint: str, results: list, elapsed: float) -> None:
+    timings = sorted(r[1] for r in results)
+    quantiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+    outcomes = Counter(r[0] for r in results)
+    print(f"{'rota':<8} {'req':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  respostas")
+    print(f"{endpoint:<8} {len(results):>6} {len(results) / elapsed:>8.1f} {quantiles[49] * 1000:>8.1f} "
+          f"{quantiles[94] * 1000:>8.1f} {quantiles[98] * 1000:>8.1f}  {dict(outcomes)}")
+
+
+def report_stages(before: dict, after: dict) -> None:
+    """
+    Tempo por etapa no intervalo do teste: média e limite do bucket que contém o p95.
+    """
+    print(f"\n{'métrica / etapa':<48} {'n':>6} {'média ms':>9} {'p95 ≤ ms':>9}")
+    for key, entry in sorted(after.items()):
+        previous = before.get(key, {"sum": 0.0, "count": 0, "buckets": {}})
+        count = entry["count"] - previous["count"]
+        if count <= 0:
+            continue
+        mean = (entry["sum"] - previous["sum"]) / count
+        p95 = "+Inf"
+        for le, cumulative in entry["buckets"].items():
+            if cumulative - previous["buckets"].get(le, 0) >= 0.95 * count:
+                p95 = f"{float(le) * 1000:.0f}" if le != "+Inf" else le
+                break
+        name, labels = key
+        label = ",".join(value for _, value in labels)
+        print(f"{name + ('{' + label + '}' if label else ''):<48} {count:>6.0f} {mean * 1000:>9.1f} {p95:>9}")
+
+
+async def benchmark(url: str, args) -> None:
+    images = load_images(args.images)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        await wait_ready(client)
+        for endpoint in args.endpoint:
+            print(f"\n== {ENDPOINTS[endpoint]}: {args.requests} requisições, concorrência {args.concurrency}")
+            before = await scrape(client)
+            started = time.perf_counter()
+            results = await run_load(client, ENDPOINTS[endpoint], images, args.concurrency, args.requests)
+            elapsed = time.perf_counter() - started
+            report_requests(endpoint, results, elapsed)
+            # com vários workers, /metrics vem de um só processo: o detalhamento é parcial
+            report_stages(before, await scrape(client))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Teste de carga das rotas de extração com LLM falso.")
+    parser.add_argument("--url", help="API já em execução (não sobe o stub nem o uvicorn).")
+    parser.add_argument("--endpoint", action="append", choices=list(ENDPOINTS),
+                        help="Rota testada (pode repetir). Padrão: check.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requisições simultâneas.")
+    parser.add_argument("--requests", type=int, default=200, help="Requisições por rota.")
+    parser.add_argument("--images", default=os.path.join(ROOT, "notas-fiscais", "*"), help="Glob das imagens enviadas.")
+    parser.add_argument("--workers", type=int, default=1, help="Workers do uvicorn.")
+    parser.add_argument("--ocr-workers", type=int, default=2, help="OCR_WORKERS da API.")
+    parser.add_argument("--timeout", type=float, default=120, help="Timeout de cada requisição (s).")
+    add_arguments(parser)
+    args = parser.parse_args()
+    args.endpoint = args.endpoint or ["check"]
+
+    if args.url:
+        asyncio.run(benchmark(args.url, args))
+        return
+
+    workdir = tempfile.mkdtemp()
+    processes, logs, url = start_processes(args, workdir)
+    try:
+        print(f"stub: latência {args.latency_dist} mediana {args.latency_ms:.0f} ms, erros {args.error_rate:.0%}; "
+              f"uvicorn com {args.workers} worker(s)")
+        asyncio.run(benchmark(url, args))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for log in logs:
+            log.close()
+    print(f"\nLogs em {workdir}")
+
+
+if __name__ == "__main__":
+    main()
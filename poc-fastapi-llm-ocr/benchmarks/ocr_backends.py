@@ -0,0 +1,70 @@
+"""
+Compara os backends de OCR (pytesseract x tesserocr) nas imagens de notas-fiscais/*.PNG.
+
+Uso (a partir da raiz do projeto):
+    python -m benchmarks.ocr_backends --repeat 3
+"""
+import argparse
+import glob
+import os
+import statistics
+import time
+
+from PIL import Image
+
+from app.ocr import OCR_LANG, PytesseractBackend, TesserocrBackend
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def bench_backend(backend, paths: list[str], repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        for path in paths:
+            with Image.open(path) as image:
+                image.load()
+                started = time.perf_counter()
+                backend.image_to_string(image)
+                timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark dos backends de OCR.")
+    parser.add_argument("--pattern", default=os.path.join(ROOT, "notas-fiscais", "*.PNG"),
+                        help="Glob das imagens usadas no benchmark.")
+    parser.add_argument("--repeat", type=int, default=3, help="Quantas vezes cada imagem é processada.")
+    parser.add_argument("--lang", default=OCR_LANG)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(args.pattern))
+    if not paths:
+        raise SystemExit(f"Nenhuma imagem encontrada em {args.pattern}")
+
+    print(f"{len(paths)} imagens x {args.repeat} repetições")
+    print(f"{'backend':<12} {'startup ms':>10} {'média ms':>10} {'mediana ms':>10} {'p95 ms':>10} {'total s':>8}")
+
+    for factory in (PytesseractBackend, TesserocrBackend):
+        started = time.perf_counter()
+        try:
+            backend = factory(args.lang)
+        except Exception as e:
+            print(f"{factory.name:<12} indisponível: {e}")
+            continue
+        startup = time.perf_counter() - started
+
+        try:
+            timings = bench_backend(backend, paths, args.repeat)
+        except Exception as e:
+            print(f"{backend.name:<12} falhou: {e}")
+            continue
+        finally:
+            backend.close()
+
+        p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+        print(f"{backend.name:<12} {startup * 1000:>10.1f} {statistics.mean(timings) * 1000:>10.1f} "
+              f"{statistics.median(timings) * 1000:>10.1f} {p95 * 1000:>10.1f} {sum(timings):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Servidor falso do Gemini e do Mistral para medir a API sem chamar os provedores reais.
+
+Responde com latência sorteada de uma distribuição configurável, uma fração de erros (503 por
+padrão) e respostas JSON de notas fiscais pré-definidas:
+
+    python -m benchmarks.stub_llm --port 8900 --latency-ms 800 --latency-dist lognormal --error-rate 0.02
+
+E a API apontando para ele:
+
+    GEMINI_API_ENDPOINT=http://127.0.0.1:8900 \
+    MISTRAL_API_URL=http://127.0.0.1:8900/v1/chat/completions \
+    uvicorn app.main:app
+
+Rotas: POST /v1beta/models/{modelo}:generateContent e :streamGenerateContent (REST do Gemini)
+e POST /v1/chat/completions (Mistral, inclusive com "stream": true).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+from dataclasses import dataclass, field
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_RESPONSES = [
+    {"cnpj": "12345678000195", "data": "15/03/2024", "valor": 123.45},
+    {"cnpj": "04252011000110", "data": "02/01/2024", "valor": 89.9},
+    {"cnpj": "33000167000101", "data": "28/02/2024", "valor": 1534.7},
+]
+
+GOOGLE_STATUS = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 503: "UNAVAILABLE", 504: "DEADLINE_EXCEEDED"}
+
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 500            # mediana da latência
+    latency_dist: str = "lognormal"    # fixed, uniform, lognormal ou exponential
+    latency_sigma: float = 0.5         # dispersão da lognormal
+    gemini_latency_ms: float | None = None   # sobrescreve latency_ms só para o Gemini
+    mistral_latency_ms: float | None = None  # sobrescreve latency_ms só para o Mistral
+    error_rate: float = 0.0
+    error_status: int = 503
+    responses: list = field(default_factory=lambda: list(DEFAULT_RESPONSES))
+    seed: int | None = None
+
+    def latency(self, provider: str) -> float:
+        """
+        Sorteia a latência (s) de uma resposta do provedor.
+        """
+        median = {"gemini": self.gemini_latency_ms, "mistral": self.mistral_latency_ms}.get(provider)
+        median = (median if median is not None else self.latency_ms) / 1000
+        if self.latency_dist == "fixed":
+            return median
+        if self.latency_dist == "uniform":
+            return random.uniform(0.5 * median, 1.5 * median)
+        if self.latency_dist == "exponential":
+            return random.expovariate(1 / median) if median > 0 else 0.0
+        return median * math.exp(random.gauss(0, self.latency_sigma))
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    app = FastAPI(title="Stub Gemini/Mistral")
+    if config.seed is not None:
+        random.seed(config.seed)
+    responses = itertools.cycle([json.dumps(response, ensure_ascii=False) for response in config.responses])
+    counts = {"gemini": 0, "mistral": 0, "errors": 0}
+
+    async def respond(provider: str):
+        """
+        Espera a latência sorteada; retorna o status de erro sorteado ou None.
+        """
+        counts[provider] += 1
+        await asyncio.sleep(config.latency(provider))
+        if random.random() < config.error_rate:
+            counts["errors"] += 1
+            return config.error_status
+        return None
+
+    @app.post("/v1beta/models/{model_action:path}")
+    async def gemini(model_action: str, request: Request):
+        await request.body()
+        status = await respond("gemini")
+        if status:
+            return JSONResponse(status_code=status, content={"error": {
+                "code": status, "message": "stub: erro simulado", "status": GOOGLE_STATUS.get(status, "UNKNOWN")}})
+
+        text = next(responses)
+        candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}
+        usage = {"promptTokenCount": 300, "candidatesTokenCount": len(text) // 4, "totalTokenCount": 300 + len(text) // 4}
+        if model_action.endswith(":streamGenerateContent"):
+            # o transporte REST do SDK lê um array JSON enviado aos poucos
+            half = len(text) // 2
+            chunks = [
+                {"candidates": [{"content": {"role": "model", "parts": [{"text": text[:half]}]}, "index": 0}]},
+                {"candidates": [{**candidate, "content": {"role": "model", "parts": [{"text": text[half:]}]}}],
+                 "usageMetadata": usage},
+            ]
+
+            async def stream():
+                yield "[" + json.dumps(chunks[0])
+                await asyncio.sleep(0.05)
+                yield ",\r\n" + json.dumps(chunks[1]) + "]"
+
+            return StreamingResponse(stream(), media_type="application/json")
+        return {"candidates": [candidate], "usageMetadata": usage}
+
+    @app.post("/v1/chat/completions")
+    async def mistral(request: Request):
+        body = await request.json()
+        status = await respond("mistral")
+        if status:
+            return JSONResponse(status_code=status, content={"message": "stub: erro simulado"})
+
+        text = next(responses)
+        usage = {"prompt_tokens": 300, "completion_tokens": len(text) // 4, "total_tokens": 300 + len(text) // 4}
+        if body.get("stream"):
+            async def stream():
+                for i in range(0, len(text), 16):
+                    chunk = {"choices": [{"index": 0, "delta": {"content": text[i:i + 16]}}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(0.01)
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(stream(), media_type="text/event-stream")
+        return {
+            "id": "stub", "object": "chat.completion", "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return counts
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=500, help="Mediana da latência das respostas (ms).")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "lognormal", "exponential"], default="lognormal")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Dispersão da distribuição lognormal.")
+    parser.add_argument("--gemini-latency-ms", type=float, help="Mediana da latência só do Gemini (ms).")
+    parser.add_argument("--mistral-latency-ms", type=float, help="Mediana da latência só do Mistral (ms).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fração das respostas que falham (0 a 1).")
+    parser.add_argument("--error-status", type=int, default=503, help="Status HTTP das falhas simuladas.")
+    parser.add_argument("--responses", help="Arquivo JSON com a lista de respostas {cnpj, data, valor} a devolver.")
+    parser.add_argument("--seed", type=int, help="Semente do sorteio de latências e erros.")
+
+
+def config_from_args(args: argparse.Namespace) -> StubConfig:
+    responses = list(DEFAULT_RESPONSES)
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as file:
+            responses = json.load(file)
+    return StubConfig(
+        latency_ms=args.latency_ms, latency_dist=args.latency_dist, latency_sigma=args.latency_sigma,
+        gemini_latency_ms=args.gemini_latency_ms, mistral_latency_ms=args.mistral_latency_ms,
+        error_rate=args.error_rate, error_status=args.error_status, responses=responses, seed=args.seed,
+    )
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Servidor falso do Gemini e do Mistral.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()